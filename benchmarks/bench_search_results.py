@@ -0,0 +1,86 @@
+"""
+Compare the lxml result page parser with the former BeautifulSoup path.
+
+    python benchmarks/bench_search_results.py                 # synthetic pages
+    python benchmarks/bench_search_results.py saved_page.html  # saved pages
+
+Synthetic pages come from stub_server.make_result_page and are padded with
+markup of the size the real portal sends around the result table.
+"""
+import argparse
+import pathlib
+import sys
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bs4 import BeautifulSoup
+
+import handels_register
+import stub_server
+
+PADDING = '<div class="ui-menu"><ul>' + '<li><a href="#">Menüpunkt</a><script>var x = 1;</script></li>' * 20 + '</ul></div>'
+
+
+def legacy_parse(html):
+    """
+    The former path: html.parser soup, several find passes for the download
+    request and find_all('td') twice per row in parse_result.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    grid = soup.find('table', role='grid')
+    tbody = soup.find('tbody', id='ergebnissForm:selectedSuchErgebnisFormTable_data')
+    first_row = tbody.find('tr') if tbody else None
+    a_tags = first_row.find_all('a') if first_row else []
+    last_a_id = first_row.find_all('a')[-1].get('id') if a_tags else None
+    form_element = soup.find('form', id='ergebnissForm')
+    action_url = form_element['action'] if form_element else ''
+    view_state_element = soup.find('input', {'name': 'javax.faces.ViewState'})
+    view_state = view_state_element.get('value') if view_state_element else None
+
+    results = []
+    for result in grid.find_all('tr') if grid else []:
+        if result.get('data-ri') is not None:
+            cells = [cell.text.strip() for cell in result.find_all('td')]
+            history_cells = result.find_all('td')[8:]
+            results.append((cells, [cell.text.strip() for cell in history_cells]))
+    return last_a_id, action_url, view_state, results
+
+
+def lxml_parse(html):
+    page = handels_register.parse_search_results(html)
+    request = handels_register.build_document_request(page)
+    results = [handels_register.HandelsRegister.parse_result_cells(row["cells"]) for row in page["rows"] or []]
+    return request, results
+
+
+def synthetic_page(rows, padding_kb):
+    page = stub_server.make_result_page("Muster Handels GmbH", rows=rows)
+    padding = PADDING * max(1, padding_kb * 1024 // len(PADDING))
+    return page.replace("<body>", "<body>" + padding, 1)
+
+
+def bench(name, html, number):
+    legacy = min(timeit.repeat(lambda: legacy_parse(html), number=number, repeat=3)) / number
+    fast = min(timeit.repeat(lambda: lxml_parse(html), number=number, repeat=3)) / number
+    print(f"{name:<30} {len(html) / 1024:>8.1f} KB {legacy * 1000:>10.2f} ms {fast * 1000:>10.2f} ms {legacy / fast:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the search result page parsing')
+    parser.add_argument("pages", nargs="*", help="Saved result pages (default: synthetic pages)")
+    parser.add_argument("--padding-kb", type=int, default=100, help="Markup around the synthetic result table")
+    parser.add_argument("--number", type=int, default=20, help="Parses per measurement")
+    args = parser.parse_args()
+
+    print(f"{'page':<30} {'size':>11} {'soup':>13} {'lxml':>13} {'speed-up':>9}")
+    if args.pages:
+        for path in args.pages:
+            bench(pathlib.Path(path).name, pathlib.Path(path).read_text(encoding="utf-8"), args.number)
+    else:
+        for rows in (1, 10, 100):
+            bench(f"synthetic, {rows} rows", synthetic_page(rows, args.padding_kb), args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+Offline benchmark suite for the parse and write hot paths.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --quick --json results.json
+    python benchmarks/run_benchmarks.py --fixtures saved_pages/ --record fixtures/
+
+Stages:
+  xml     XMLParser.parse_xml, retrieve_xml_data and iter_xml_data on XJustiz
+          documents with 1, 10, 100 and 1,000 persons, stream_document
+          writing them to disk from a response, and the rows of 100 such
+          documents held in memory at once
+  search  parse_search_results / parse_result_cells and the whole
+          HandelsRegister.get_companies_in_searchresults (document served from
+          the cache, so no request leaves the machine) on result pages with
+          1, 10 and 100 rows, plus any saved pages given with --fixtures
+  excel   save_to_excel of one company and ExcelResultWriter with 100
+          companies against workbooks with 1k, 10k and 100k existing rows,
+          and the SQLite result writer against databases of the same size
+  startup cold start of a fresh interpreter: importing handels_register,
+          the parse command on an empty directory and fetch --help
+
+Every case runs in a forked child process. The time is the best of --repeat
+runs; "py peak" is the tracemalloc peak of one extra run (Python objects
+only), "rss peak" the peak resident size of the child (includes lxml's C
+allocations and the interpreter).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import pathlib
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import openpyxl
+
+import handels_register
+import stub_server
+
+PERSON_COUNTS = (1, 10, 100, 1000)
+RESULT_ROWS = (1, 10, 100)
+EXCEL_ROWS = (1000, 10000, 100000)
+QUICK_EXCEL_ROWS = (1000, 10000)
+
+
+def run_case(fn, repeat, connection):
+    setup = fn()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        setup()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    setup()
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    connection.send((best, py_peak, rss_peak))
+    connection.close()
+
+
+def measure(fn, repeat):
+    """
+    Run fn() in a forked child; fn prepares the case and returns the callable
+    that is timed. Returns (seconds, python peak bytes, rss peak bytes).
+    """
+    context = multiprocessing.get_context("fork")
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=run_case, args=(fn, repeat, child))
+    process.start()
+    child.close()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def xjustiz_fixture(directory, persons):
+    path = directory / f"xjustiz_{persons}_persons.xml"
+    if not path.exists():
+        path.write_text(stub_server.make_xjustiz_document("Muster Handels GmbH", persons=persons), encoding="utf-8")
+    return path
+
+
+def result_page_fixture(directory, rows):
+    path = directory / f"result_page_{rows}_rows.html"
+    if not path.exists():
+        path.write_text(stub_server.make_result_page("Muster Handels GmbH", rows=rows), encoding="utf-8")
+    return path
+
+
+def workbook_fixture(directory, rows):
+    path = directory / f"workbook_{rows}_rows.xlsx"
+    if path.exists():
+        return path
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Current output")
+    sheet_2 = workbook.create_sheet("Goal output")
+    sheet.append(handels_register.CURRENT_OUTPUT_HEADER)
+    sheet_2.append(handels_register.GOAL_OUTPUT_HEADER)
+    for i in range(rows):
+        sheet.append([f"Firma {i // 5}", "Amtsgericht Berlin", "Berlin", "aktuell", "AD SI"])
+        sheet_2.append([
+            f"Firma {i // 5}", "Amtsgericht Berlin", "Berlin", "aktuell", f"Firma {i // 5} GmbH", "GmbH",
+            "Hauptstraße", str(i % 200), "10115", "Berlin", f"Vorname{i % 5}", f"Nachname{i}",
+            "männlich", "1970-01-01", "Handel mit Waren", "Einzelvertretung",
+        ])
+    workbook.save(path)
+    return path
+
+
+def company_rows(index, persons=5):
+    company = {"name": f"Firma {index}", "court": "Amtsgericht Berlin", "state": "Berlin", "status": "aktuell", "documents": "AD SI"}
+    merged = [
+        {**company, "bezeichnung": f"Firma {index} GmbH", "rechtsform": "GmbH", "vorname": f"Vorname{i}", "nachname": "Neu"}
+        for i in range(persons)
+    ]
+    return [company], merged
+
+
+class FakeResponse:
+    """
+    Stands in for a streamed requests response with body already in memory.
+    """
+    status_code = 200
+    url = "http://localhost/document"
+    headers = {"Content-Type": "application/xml"}
+
+    def __init__(self, body):
+        self.body = body
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def bench_xml(fixtures, args, report):
+    for persons in PERSON_COUNTS:
+        path = str(xjustiz_fixture(fixtures, persons))
+
+        def parse():
+            return lambda: handels_register.XMLParser(path).parse_xml()
+
+        def retrieve():
+            xml_parser = handels_register.XMLParser(path)
+            xml_parser.parse_xml()
+            return lambda: xml_parser.retrieve_xml_data(handels_register.XJUSTIZ_NAMESPACES)
+
+        def stream():
+            return lambda: sum(1 for _ in handels_register.XMLParser(path).iter_xml_data(handels_register.XJUSTIZ_NAMESPACES))
+
+        report("xml", f"parse_xml, {persons} persons", measure(parse, args.repeat))
+        report("xml", f"retrieve_xml_data, {persons} persons", measure(retrieve, args.repeat))
+        def download():
+            body = pathlib.Path(path).read_bytes()
+            target = str(pathlib.Path(tempfile.mkdtemp(prefix="bench_download_")) / "document.xml")
+            return lambda: handels_register.stream_document(FakeResponse(body), target)
+
+        report("xml", f"iter_xml_data, {persons} persons", measure(stream, args.repeat))
+        report("xml", f"stream_document, {persons} persons", measure(download, args.repeat))
+
+    # Rows of 100 documents held at once, as parse does before writing them
+    path = str(xjustiz_fixture(fixtures, PERSON_COUNTS[-1]))
+
+    def hold():
+        namespaces = handels_register.XJUSTIZ_NAMESPACES
+        return lambda: [row for _ in range(100) for row in handels_register.XMLParser(path).iter_xml_data(namespaces)]
+
+    report("xml", f"hold rows, 100 x {PERSON_COUNTS[-1]} persons", measure(hold, args.repeat))
+
+
+def bench_search(fixtures, args, report):
+    pages = [(f"{rows} rows", result_page_fixture(fixtures, rows)) for rows in RESULT_ROWS]
+    if args.fixtures:
+        pages += [(path.name, path) for path in sorted(pathlib.Path(args.fixtures).glob("*.htm*"))]
+
+    for name, path in pages:
+        html = path.read_text(encoding="utf-8")
+
+        def parse():
+            def run():
+                page = handels_register.parse_search_results(html)
+                return [handels_register.HandelsRegister.parse_result_cells(row["cells"])
+                        for row in page["rows"] or [] if len(row["cells"]) > 5]
+            return run
+
+        def searchresults():
+            # The SI document is served from the cache of a scratch directory
+            workdir = tempfile.mkdtemp(prefix="bench_search_")
+            os.chdir(workdir)
+            os.mkdir("files")
+            h = handels_register.HandelsRegister(handels_register.parse_args(
+                "Muster Handels GmbH", ["--cache-dir", os.path.join(workdir, "cache")]))
+            h.cache.put("xml", h.schlagwoerter, h.args.schlagwortOptionen,
+                        stub_server.make_xjustiz_document("Muster Handels GmbH").encode("utf-8"))
+            return lambda: h.get_companies_in_searchresults(html, {}, "files/.xml", "Muster Handels GmbH")
+
+        report("search", f"parse_search_results, {name}", measure(parse, args.repeat))
+        report("search", f"get_companies_in_searchresults, {name}", measure(searchresults, args.repeat))
+
+
+def bench_excel(fixtures, args, report):
+    for rows in QUICK_EXCEL_ROWS if args.quick else EXCEL_ROWS:
+        source = workbook_fixture(fixtures, rows)
+
+        def copy_workbook():
+            workdir = pathlib.Path(tempfile.mkdtemp(prefix="bench_excel_"))
+            target = workdir / source.name
+            target.write_bytes(source.read_bytes())
+            return str(target)
+
+        def save_one():
+            target = copy_workbook()
+            return lambda: handels_register.save_to_excel(*company_rows(0), target)
+
+        def writer_batch():
+            target = copy_workbook()
+
+            def run():
+                with handels_register.ExcelResultWriter(target, flush_every=0) as writer:
+                    for index in range(100):
+                        writer.add(*company_rows(index))
+            return run
+
+        def sqlite_batch():
+            # The same rows in a result database instead of the workbook
+            target = str(pathlib.Path(tempfile.mkdtemp(prefix="bench_sqlite_")) / "results.sqlite")
+            with handels_register.open_result_writer(target, flush_every=0) as writer:
+                for index in range(rows // 5):
+                    writer.add(*company_rows(index + 1000000))
+
+            def run():
+                with handels_register.open_result_writer(target, flush_every=0) as writer:
+                    for index in range(100):
+                        writer.add(*company_rows(index))
+            return run
+
+        report("excel", f"save_to_excel, 1 company, {rows} rows", measure(save_one, args.repeat))
+        report("excel", f"ExcelResultWriter, 100 companies, {rows} rows", measure(writer_batch, args.repeat))
+        report("excel", f"SQLite writer, 100 companies, {rows} rows", measure(sqlite_batch, args.repeat))
+
+
+def bench_startup(fixtures, args, report):
+    script = str(pathlib.Path(handels_register.__file__).resolve())
+    empty_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    commands = [
+        ("import handels_register", ["-c", "import handels_register"]),
+        ("parse, no files", [script, "parse", "--files-dir", empty_dir]),
+        ("fetch --help", [script, "fetch", "--help"]),
+    ]
+    for name, command in commands:
+        def start():
+            return lambda: subprocess.run([sys.executable] + command, cwd=str(pathlib.Path(script).parent),
+                                          stdout=subprocess.DEVNULL, check=True)
+        report("startup", name, measure(start, args.repeat))
+
+
+STAGES = {"xml": bench_xml, "search": bench_search, "excel": bench_excel, "startup": bench_startup}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the parse and write hot paths')
+    parser.add_argument("stages", nargs="*", choices=[[]] + list(STAGES), help="Stages to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case, the best is reported")
+    parser.add_argument("--quick", action="store_true", help="Skip the 100k row workbook")
+    parser.add_argument("--fixtures", help="Directory with saved search result pages (*.html) to benchmark as well")
+    parser.add_argument("--record", help="Keep the generated fixtures in this directory (default: temporary)")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    fixtures = pathlib.Path(args.record or tempfile.mkdtemp(prefix="bench_fixtures_"))
+    fixtures.mkdir(parents=True, exist_ok=True)
+
+    # The code under test prints progress; keep it out of the report
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+    results = []
+
+    def report(stage, case, measurement):
+        seconds, py_peak, rss_peak = measurement
+        results.append({"stage": stage, "case": case, "seconds": seconds, "py_peak": py_peak, "rss_peak": rss_peak})
+        print(f"{stage:<7} {case:<52} {seconds * 1000:>10.2f} ms {py_peak / 2**20:>9.2f} MB {rss_peak / 2**20:>9.1f} MB",
+              file=stdout, flush=True)
+
+    print(f"{'stage':<7} {'case':<52} {'time':>13} {'py peak':>12} {'rss peak':>12}")
+    sys.stdout = devnull
+    try:
+        for stage in args.stages or list(STAGES):
+            STAGES[stage](fixtures, args, report)
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,30 @@
 import argparse
-import mechanize
 import pathlib
 import sys
-from bs4 import BeautifulSoup
-import openpyxl
-from openpyxl.utils.exceptions import InvalidFileException
-import zipfile
-import requests
 import os
-import pandas as pd
-from tqdm import tqdm
-import xml.etree.ElementTree as ET
 from lxml import etree
-import concurrent.futures
+import csv
+import collections
+import json
+import re
+import sqlite3
+import hashlib
+import mmap
+import shutil
+import uuid
+import random
+import urllib.parse
+import threading
+import contextlib
+import queue
+import time
+import bisect
+import itertools
+import functools
+
+# mechanize, requests, BeautifulSoup, openpyxl, tqdm, asyncio and
+# concurrent.futures are imported by the functions that use them, so the
+# parse and export commands start without loading the download stack
 
 # Dictionaries to map arguments to values
 schlagwortOptionen = {
@@ -21,6 +33,151 @@ schlagwortOptionen = {
     "exact": 3
 }
 
+BASE_URL = "https://www.handelsregister.de/rp_web"
+
+# Headers sent with the search requests
+BROWSER_HEADERS = [
+    (
+        "User-Agent",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.5 Safari/605.1.15",
+    ),
+    ("Accept-Language", "en-GB,en;q=0.9"),
+    ("Accept-Encoding", "gzip, deflate, br"),
+    (
+        "Accept",
+        "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    ),
+    ("Connection", "keep-alive"),
+]
+
+# Headers of the POST that downloads a document from the search results
+DOCUMENT_HEADERS = {
+    "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+    "accept-encoding": "gzip, deflate, br, zstd",
+    "accept-language": "en-GB,en-US;q=0.9,en;q=0.8",
+    "cache-control": "max-age=0",
+    "connection": "keep-alive",
+    "content-type": "application/x-www-form-urlencoded",
+    "sec-ch-ua": '"Not)A;Brand";v="99", "Google Chrome";v="127", "Chromium";v="127"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"',
+    "sec-fetch-dest": "document",
+    "sec-fetch-mode": "navigate",
+    "sec-fetch-site": "same-origin",
+    "sec-fetch-user": "?1",
+    "upgrade-insecure-requests": "1",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36"
+}
+
+def document_headers(base_url=BASE_URL):
+    """
+    DOCUMENT_HEADERS with origin and referer of the portal at base_url. The
+    host header is left to requests, which also matches the cookies by it.
+    """
+    parts = urllib.parse.urlsplit(base_url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    return {**DOCUMENT_HEADERS, "origin": origin, "referer": f"{origin}/"}
+
+
+def ajax_headers(base_url=BASE_URL):
+    """
+    Headers of a PrimeFaces AJAX request (result table paging).
+    """
+    return {
+        **document_headers(base_url),
+        "accept": "application/xml, text/xml, */*; q=0.01",
+        "faces-request": "partial/ajax",
+        "x-requested-with": "XMLHttpRequest",
+    }
+
+# Namespace of the XJustiz documents served as "SI" (structured content)
+XJUSTIZ_NAMESPACES = {'tns': 'http://www.xjustiz.de'}
+
+# Fields extracted from the XJustiz documents as (field, scope, path, source).
+# path is the local tag name (tns namespace) of the element, optionally
+# preceded by its parents, e.g. "anschrift/ort"; source is the stripped
+# text of the element or the comment inside it (the label of a code value).
+# Company fields keep their first non-empty match in document order; person
+# fields belong to the <tns:beteiligung> that holds the <tns:vollerName>.
+# Several entries may fill the same field, the first match wins.
+XJUSTIZ_FIELDS = [
+    ("bezeichnung", "company", "bezeichnung.aktuell", "text"),
+    ("rechtsform", "company", "angabenZurRechtsform/rechtsform", "comment"),
+    ("strasse", "company", "anschrift/strasse", "text"),
+    ("hausnummer", "company", "anschrift/hausnummer", "text"),
+    ("postleitzahl", "company", "anschrift/postleitzahl", "text"),
+    ("ort", "company", "anschrift/ort", "text"),
+    ("gegenstand", "company", "basisdatenRegister/gegenstand", "text"),
+    ("vertretungsbefugnis", "company", "auswahl_vertretungsbefugnis/vertretungsbefugnisFreitext", "text"),
+    ("registernummer", "company", "instanzdaten/aktenzeichen", "text"),
+    ("registernummer", "company", "aktenzeichen/aktenzeichen.freitext", "text"),
+    ("gericht", "company", "auswahl_instanzbehoerde/gericht", "comment"),
+    ("vorname", "person", "vollerName/vorname", "text"),
+    ("nachname", "person", "vollerName/nachname", "text"),
+    ("geschlecht", "person", "geschlecht", "comment"),
+    ("geburtsdatum", "person", "geburtsdatum", "text"),
+    ("rolle", "person", "rolle/rollenbezeichnung", "comment"),  # e.g. Geschäftsführer(in), Prokurist(in)
+]
+
+# Element enclosing the fields of one person, and the element marking it as a person
+PERSON_SCOPE_TAG = "beteiligung"
+PERSON_MARKER_TAG = "vollerName"
+
+# Columns of the rows produced by the XML parser, one row per person
+XML_FIELDS = [
+    "bezeichnung", "rechtsform", "strasse", "hausnummer", "postleitzahl",
+    "ort", "vorname", "nachname", "geschlecht", "geburtsdatum", "gegenstand",
+    "vertretungsbefugnis", "registernummer", "gericht", "rolle"
+]
+
+# Columns of the rows produced by the offline XML parser
+XML_ROW_FIELDS = ["file"] + XML_FIELDS
+
+# A parsed row is unique per company and person; database outputs upsert on it
+XML_ROW_KEY = ("bezeichnung", "vorname", "nachname")
+
+# Company and person columns of a row, and the columns identifying a person
+# across two versions of a document (used by the change feed)
+COMPANY_FIELDS = [field for field in XML_FIELDS if field in {f for f, scope, _, _ in XJUSTIZ_FIELDS if scope == "company"}]
+PERSON_FIELDS = [field for field in XML_FIELDS if field not in COMPANY_FIELDS]
+PERSON_KEY = ("vorname", "nachname", "geburtsdatum")
+
+# One person of a parsed document with the company fields (XML_ROW_FIELDS),
+# and one row of the search result table. Named tuples keep no per-instance
+# dict; the row sinks write their values in field order.
+PersonRecord = collections.namedtuple("PersonRecord", XML_ROW_FIELDS, defaults=[None] * len(XML_ROW_FIELDS))
+CompanyRecord = collections.namedtuple("CompanyRecord", ["court", "name", "state", "status", "documents", "history"])
+
+
+class FieldMap:
+    """
+    XJUSTIZ_FIELDS compiled for one namespace.
+
+    by_tag maps the Clark tag of a matched element to its entries
+    (parent tags nearest first, field, scope, source), so the walk over a
+    document costs one dict lookup per element, however many fields are
+    mapped. Built once per namespace by compile_field_map.
+    """
+    def __init__(self, fields, namespace):
+        tns = "{%s}" % namespace
+        self.by_tag = {}
+        for field, scope, path, source in fields:
+            *parents, local = path.split("/")
+            self.by_tag.setdefault(tns + local, []).append(
+                (tuple(tns + tag for tag in reversed(parents)), field, scope, source))
+        self.company_fields = frozenset(field for field, scope, _, _ in fields if scope == "company")
+        self.person_fields = frozenset(field for field, scope, _, _ in fields if scope == "person")
+        # Elements read from their comment when they close (stream mode keeps their children)
+        self.comment_tags = frozenset(tns + path.split("/")[-1] for _, _, path, source in fields if source == "comment")
+        self.person_scope = tns + PERSON_SCOPE_TAG
+        self.person_marker = tns + PERSON_MARKER_TAG
+
+
+@functools.lru_cache(maxsize=None)
+def compile_field_map(namespace):
+    return FieldMap(XJUSTIZ_FIELDS, namespace)
+
+
 class XMLParser:
     def __init__(self, xml_file_path):
         self.xml_file_path = xml_file_path
@@ -47,61 +204,839 @@ class XMLParser:
     def get_comment_from_element(self, element_path, namespaces=None):
         element = self.root.xpath(element_path, namespaces=namespaces)
         if element:
-            for comment in self.root.xpath('//comment()'):
-                if comment.getparent() == element[0]:
-                    return comment.text.strip()
+            return self.get_element_comment(element[0])
+        return None
+
+    @staticmethod
+    def get_element_comment(element):
+        """
+        Return the stripped text of the first comment directly inside element.
+        """
+        if element is None:
+            return None
+        for child in element:
+            if child.tag is etree.Comment:
+                return child.text.strip() if child.text else None
         return None
 
     def retrieve_xml_data(self, namespaces):
         """
         This function will parse and retrieve elements from the XML.
+
+        The document is walked exactly once and every element is matched
+        against the compiled XJUSTIZ_FIELDS; one PersonRecord is returned
+        per person.
         """
-        results = []
+        field_map = compile_field_map(namespaces["tns"])
+        company = {}
+        scopes = {}  # <tns:beteiligung> -> its person fields
+        persons = {}  # the scopes holding a <tns:vollerName>, in document order
 
-        # Find all <tns:vollerName> elements
-        vollerName_elements = self.root.findall('.//tns:vollerName', namespaces=namespaces)
+        for element in self.root.iter(tag=etree.Element):
+            self._visit_element(element, field_map, company, scopes, persons)
 
-        # Count the occurrences of <tns:vollerName>
-        count_vollerName = len(vollerName_elements)
-    
-        for i in range(count_vollerName):
-            bezeichnung_aktuell = self.get_element_text('.//tns:bezeichnung.aktuell', namespaces=namespaces)
-            anschrift_strasse = self.get_element_text('.//tns:anschrift/tns:strasse', namespaces=namespaces)
-            anschrift_hausnummer = self.get_element_text('.//tns:anschrift/tns:hausnummer', namespaces=namespaces)
-            anschrift_postleitzahl = self.get_element_text('.//tns:anschrift/tns:postleitzahl', namespaces=namespaces)
-            anschrift_ort = self.get_element_text('.//tns:anschrift/tns:ort', namespaces=namespaces)
-
-            vorname = vollerName_elements[i].find('tns:vorname', namespaces=namespaces).text
-            nachname = vollerName_elements[i].find('tns:nachname', namespaces=namespaces).text
-            geburtsdatum = self.root.findall('.//tns:geburtsdatum', namespaces=namespaces)[i].text  
-
-            geschlecht = self.get_comment_from_element('.//tns:geschlecht', namespaces=namespaces)
-            rechtsform_comment = self.get_comment_from_element('.//tns:angabenZurRechtsform/tns:rechtsform', namespaces=namespaces)
-            gegenstand = self.get_element_text('.//tns:basisdatenRegister/tns:gegenstand', namespaces=namespaces)
-            vertretungsbefugnis = self.get_element_text('.//tns:auswahl_vertretungsbefugnis/tns:vertretungsbefugnisFreitext', namespaces=namespaces)
-            
-            result = {
-                "bezeichnung":bezeichnung_aktuell,
-                "rechtsform":rechtsform_comment,
-                "strasse":anschrift_strasse,
-                "hausnummer":anschrift_hausnummer,
-                "postleitzahl":anschrift_postleitzahl,
-                "ort":anschrift_ort,
-                "vorname":vorname,
-                "nachname":nachname,
-                "geschlecht":geschlecht,
-                "geburtsdatum":geburtsdatum,
-                "gegenstand":gegenstand,
-                "vertretungsbefugnis":vertretungsbefugnis
+        return [self._build_row(company, person) for person in persons.values()]
+
+    def iter_xml_data(self, namespaces):
+        """
+        Stream the XML with iterparse and yield the same rows as
+        retrieve_xml_data without keeping the document in memory.
+
+        Processed elements are cleared as soon as they close. A person's row
+        is yielded once its <tns:beteiligung> has closed and all company
+        fields are known; fields that only appear after the persons (e.g.
+        gegenstand) delay the rows until they are seen.
+        """
+        field_map = compile_field_map(namespaces["tns"])
+        company = {}
+        scopes = {}
+        persons = {}
+        finished = []  # persons whose subtree is closed, waiting for company data
+
+        try:
+            context = etree.iterparse(self.xml_file_path, events=("end",), recover=True)
+            for _, element in context:
+                if not isinstance(element.tag, str):
+                    continue
+                self._visit_element(element, field_map, company, scopes, persons)
+
+                if element.tag == field_map.person_scope:
+                    scopes.pop(element, None)
+                    person = persons.pop(element, None)
+                    if person is not None:
+                        finished.append(person)
+                if finished and len(company) == len(field_map.company_fields):
+                    for person in finished:
+                        yield self._build_row(company, person)
+                    finished.clear()
+
+                # Free the closed subtree and any siblings already handled,
+                # unless the parent still has to read its comment on close
+                parent = element.getparent()
+                if parent is None or parent.tag in field_map.comment_tags:
+                    continue
+                element.clear(keep_tail=True)
+                while element.getprevious() is not None:
+                    del parent[0]
+            del context
+        except etree.XMLSyntaxError as e:
+            print(f"Error parsing XML: {e}")
+            raise
+        except FileNotFoundError as e:
+            print(f"File not found: {e}")
+            raise
+
+        # Documents that lack some company fields never complete the rows
+        # above, so flush whatever is left with the fields that were found
+        for person in finished + list(persons.values()):
+            yield self._build_row(company, person)
+
+    def _visit_element(self, element, field_map, company, scopes, persons):
+        tag = element.tag
+        if tag == field_map.person_marker:
+            scope = self._find_scope(element, field_map.person_scope)
+            if scope is not None and scope not in persons:
+                persons[scope] = scopes.setdefault(scope, {})
+
+        entries = field_map.by_tag.get(tag)
+        if entries is None:
+            return
+        for parents, field, scope, source in entries:
+            if parents and not self._has_parents(element, parents):
+                continue
+            if scope == "company":
+                target = company
+            else:
+                owner = self._find_scope(element, field_map.person_scope)
+                if owner is None:
+                    continue
+                target = scopes.setdefault(owner, {})
+            if field in target:
+                continue
+            value = self.get_element_comment(element) if source == "comment" else self._strip_text(element)
+            if value:
+                target[field] = value
+
+    @staticmethod
+    def _has_parents(element, parents):
+        parent = element.getparent()
+        for tag in parents:
+            if parent is None or parent.tag != tag:
+                return False
+            parent = parent.getparent()
+        return True
+
+    @staticmethod
+    def _find_scope(element, scope_tag):
+        # Walk up to the enclosing <tns:beteiligung>
+        parent = element.getparent()
+        while parent is not None:
+            if parent.tag == scope_tag:
+                return parent
+            parent = parent.getparent()
+        return None
+
+    @staticmethod
+    def _build_row(company, person):
+        return PersonRecord._make([None] + [
+            person[field] if field in person else company.get(field) for field in XML_FIELDS])
+
+    @staticmethod
+    def _strip_text(element):
+        return element.text.strip() if element.text else None
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metrics:
+    """
+    Counters and per-stage latency histograms of a run, shared by all threads.
+
+    Stages are timed with `with METRICS.timer("stage"):`, which also counts
+    the exceptions leaving it; counters take labels such as
+    http_responses{stage, status}. write() saves a snapshot as a Prometheus
+    textfile (.prom, replaced atomically) or appends it as JSON lines.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.histograms = {}
+        self.started_at = time.time()
+
+    def count(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = {
+                    "count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(self.buckets) + 1)}
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+            histogram["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.count("stage_errors", stage=stage, error=type(e).__name__)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def response(self, stage, status, size):
+        self.count("http_responses", stage=stage, status=str(status))
+        self.count("bytes_downloaded", size, stage=stage)
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {stage: {**histogram, "buckets": list(histogram["buckets"])}
+                          for stage, histogram in self.histograms.items()}
+        return counters, histograms
+
+    def cumulative_buckets(self, counts):
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return zip(bounds, itertools.accumulate(counts))
+
+    def summary(self):
+        """
+        Return one line per stage (calls, mean, max, total) and per counter.
+        """
+        counters, histograms = self.snapshot()
+        lines = [
+            f"{stage}: {h['count']} calls, mean {h['sum'] / h['count']:.3f}s, max {h['max']:.3f}s, total {h['sum']:.1f}s"
+            for stage, h in sorted(histograms.items(), key=lambda item: -item[1]["sum"])
+        ]
+        for (name, labels), value in sorted(counters.items()):
+            label_text = ",".join(f"{key}={value}" for key, value in labels)
+            lines.append(f"{name}{{{label_text}}}: {value}" if labels else f"{name}: {value}")
+        return lines
+
+    def write(self, path):
+        if pathlib.Path(path).suffix.lower() == ".prom":
+            self.write_prometheus(path)
+        else:
+            self.write_json_lines(path)
+
+    def write_json_lines(self, path):
+        counters, histograms = self.snapshot()
+        now = time.time()
+        with open(path, "a", encoding="utf-8") as file:
+            for stage, h in sorted(histograms.items()):
+                file.write(json.dumps({
+                    "time": now, "run_started": self.started_at, "type": "histogram", "stage": stage,
+                    "count": h["count"], "sum": h["sum"], "max": h["max"],
+                    "buckets": dict(self.cumulative_buckets(h["buckets"])),
+                }) + "\n")
+            for (name, labels), value in sorted(counters.items()):
+                file.write(json.dumps({
+                    "time": now, "run_started": self.started_at, "type": "counter", "name": name,
+                    "labels": dict(labels), "value": value,
+                }) + "\n")
+
+    def write_prometheus(self, path):
+        counters, histograms = self.snapshot()
+
+        def label_text(labels):
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+            return ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped))
+
+        lines = [
+            "# HELP handelsregister_stage_seconds Latency of the pipeline stages",
+            "# TYPE handelsregister_stage_seconds histogram",
+        ]
+        for stage, h in sorted(histograms.items()):
+            stage_label = label_text([("stage", stage)])
+            for bound, count in self.cumulative_buckets(h["buckets"]):
+                lines.append(f'handelsregister_stage_seconds_bucket{{{stage_label},le="{bound}"}} {count}')
+            lines.append(f"handelsregister_stage_seconds_sum{{{stage_label}}} {h['sum']}")
+            lines.append(f"handelsregister_stage_seconds_count{{{stage_label}}} {h['count']}")
+
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            metric = f"handelsregister_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{{{label_text(labels)}}} {value}" if labels else f"{metric} {value}")
+        lines.append(f"handelsregister_run_started_seconds {self.started_at}")
+
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+# Metrics of the current run
+METRICS = Metrics()
+
+
+class ResultCache:
+    """
+    On-disk cache of search result pages ("html"), SI documents ("xml") and
+    the document lists of --all-results searches ("list").
+
+    Entries are keyed on a hash of (schlagwoerter, schlagwortOptionen). The
+    modification time of a file is when it was stored and is checked against
+    ttl seconds; the access time is bumped on every hit and drives the LRU
+    eviction once the directory grows beyond max_bytes. The size of the
+    directory is scanned once and then kept as a running total, so a put
+    only lists the directory when it pushes the total over max_bytes; the
+    eviction then drops entries down to EVICT_TO of max_bytes. Files are
+    written to a temporary name and renamed, so concurrent readers never see
+    partial entries; the lock serialises the total and eviction between the
+    threads of a run.
+    """
+    KINDS = ("html", "xml", "list")
+    EVICT_TO = 0.9
+
+    def __init__(self, cachedir="cache", ttl=7 * 24 * 3600, max_bytes=500 * 1024 * 1024):
+        self.cachedir = pathlib.Path(cachedir)
+        self.cachedir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = sum(size for _, size, _ in self.entries()) if max_bytes else 0
+
+    def key(self, schlagwoerter, schlagwort_option):
+        return hashlib.sha256(f"{schlagwort_option}\0{schlagwoerter}".encode("utf-8")).hexdigest()
+
+    def path(self, kind, schlagwoerter, schlagwort_option):
+        return self.cachedir / f"{self.key(schlagwoerter, schlagwort_option)}.{kind}"
+
+    def lookup(self, kind, schlagwoerter, schlagwort_option):
+        """
+        Path of a fresh entry, or None; documents are copied from it file to file.
+        """
+        path = self.path(kind, schlagwoerter, schlagwort_option)
+        try:
+            stat = path.stat()
+            if self.ttl and time.time() - stat.st_mtime > self.ttl:
+                METRICS.count("cache_lookups", kind=kind, result="expired")
+                return None
+            # Mark as recently used, keep the stored time
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            METRICS.count("cache_lookups", kind=kind, result="miss")
+            return None
+        METRICS.count("cache_lookups", kind=kind, result="hit")
+        return path
+
+    def get(self, kind, schlagwoerter, schlagwort_option):
+        path = self.lookup(kind, schlagwoerter, schlagwort_option)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, kind, schlagwoerter, schlagwort_option, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self._store(kind, schlagwoerter, schlagwort_option, lambda tmp_path: tmp_path.write_bytes(content))
+
+    def put_file(self, kind, schlagwoerter, schlagwort_option, source_path):
+        """
+        Store a copy of the file source_path without reading it into memory.
+        """
+        self._store(kind, schlagwoerter, schlagwort_option, lambda tmp_path: shutil.copyfile(source_path, tmp_path))
+
+    def _store(self, kind, schlagwoerter, schlagwort_option, write):
+        path = self.path(kind, schlagwoerter, schlagwort_option)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            write(tmp_path)
+            size = tmp_path.stat().st_size
+            with self.lock:
+                # An entry stored again replaces the size of the old file
+                try:
+                    size -= path.stat().st_size
+                except FileNotFoundError:
+                    pass
+                os.replace(tmp_path, path)
+                self.total_bytes += size
+        except OSError as e:
+            print(f"Error while writing cache file {path}: {e}")
+            with contextlib.suppress(OSError):
+                tmp_path.unlink()
+            return
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """
+        (access time, size, path) of every cache entry.
+        """
+        entries = []
+        for path in self.cachedir.iterdir():
+            if path.suffix.lstrip(".") not in self.KINDS:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        if not self.max_bytes:
+            return
+        with self.lock:
+            # Another thread may have evicted while this one waited
+            if self.total_bytes <= self.max_bytes:
+                return
+            # Rescan, which also picks up entries written by other processes
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+
+            # Drop the least recently used entries until the cache fits
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * self.EVICT_TO:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+                total -= size
+            self.total_bytes = total
+
+
+RESULT_TABLE_ID = "ergebnissForm:selectedSuchErgebnisFormTable"
+
+# Upper bound for paging through one result table
+MAX_RESULT_PAGES = 100
+
+# Compiled once; evaluated on the lxml tree of every result page
+RESULT_TABLE_XPATH = etree.XPath('(//tbody[@id="ergebnissForm:selectedSuchErgebnisFormTable_data"])[1]')
+RESULT_FORM_ACTION_XPATH = etree.XPath('(//form[@id="ergebnissForm"])[1]/@action')
+VIEW_STATE_XPATH = etree.XPath('(//input[@name="javax.faces.ViewState"])[1]/@value')
+RESULT_CELLS_XPATH = etree.XPath('.//td')
+RESULT_ANCHORS_XPATH = etree.XPath('.//a')
+RESULT_PAGE_PARSER = etree.HTMLParser(encoding="utf-8")
+
+
+def parse_search_results(html):
+    """
+    Extract everything needed from a search result page in one lxml parse:
+    the result form action, the ViewState and per result row its cell texts
+    and anchor ids. rows is None if the page has no result table. html is a
+    str or UTF-8 encoded bytes.
+    """
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    root = etree.fromstring(html, RESULT_PAGE_PARSER) if html else None
+    if root is None:
+        return {"action": None, "view_state": None, "rows": None}
+
+    action = RESULT_FORM_ACTION_XPATH(root)
+    view_state = VIEW_STATE_XPATH(root)
+    tbody = RESULT_TABLE_XPATH(root)
+
+    rows = None
+    if tbody:
+        rows = [
+            {
+                "data_ri": row.get("data-ri"),
+                "cells": ["".join(cell.itertext()).strip() for cell in RESULT_CELLS_XPATH(row)],
+                "anchor_ids": [anchor.get("id") for anchor in RESULT_ANCHORS_XPATH(row)],
             }
+            for row in tbody[0].iterchildren("tr")
+        ]
 
-            results.append(result)
+    return {
+        "action": action[0] if action else None,
+        "view_state": view_state[0] if view_state else None,
+        "rows": rows,
+    }
+
+
+def result_form_url(page, base_url=BASE_URL):
+    """
+    URL the result form posts to (documents and paging).
+    """
+    action_url = page["action"] or ''
+    query_string = action_url.split('?')[1] if '?' in action_url else ''
+
+    # Construct the URL for the POST request
+    return f"{base_url}/xhtml/research/sucheErgebnisse.xhtml?{query_string}"
+
+
+def build_document_request(page, base_url=BASE_URL, row_index=0, rows_per_page=10):
+    """
+    Build the POST (url, form data) that downloads the SI document of the
+    row_index-th row of the result page (the first by default), or return
+    None if the page has no such row. page is the result of
+    parse_search_results or parse_partial_response.
+    """
+    rows = page["rows"]
+    if rows is None:
+        print("No results table found. This error maybe probably due to incorrect company name.")
+        return None # Exit the function if the tbody is not found
+
+    if not rows:
+        print("No rows found in the results table. This error maybe probably due to incorrect company name.")
+        return None # Exit the function if no rows are found
+
+    # The anchors of the row, the last one requests the SI document
+    anchor_ids = rows[row_index]["anchor_ids"] if row_index < len(rows) else None
+    if not anchor_ids:
+        print("No <a> tags found in the first row. This error maybe probably due to incorrect company name.")
+        return None # Exit the function if no <a> tags are found
+
+    last_a_id = anchor_ids[-1]
+    url = result_form_url(page, base_url)
+
+    data = {
+        "ergebnissForm": "ergebnissForm",
+        "ergebnissForm:selectedSuchErgebnisFormTable_rppDD": str(rows_per_page),
+        "javax.faces.ViewState": f"{page['view_state']}",
+        "property2": "",
+        f"{last_a_id}": f"{last_a_id}",
+        "property": "Global.Dokumentart.SI"
+    }
+    return url, data
+
+
+def build_pagination_request(page, first, rows, base_url=BASE_URL):
+    """
+    Build the PrimeFaces AJAX POST (url, form data) that shows the result
+    rows first .. first + rows - 1 in the server-side table.
+    """
+    data = {
+        "javax.faces.partial.ajax": "true",
+        "javax.faces.source": RESULT_TABLE_ID,
+        "javax.faces.partial.execute": RESULT_TABLE_ID,
+        "javax.faces.partial.render": RESULT_TABLE_ID,
+        "javax.faces.behavior.event": "page",
+        "javax.faces.partial.event": "page",
+        f"{RESULT_TABLE_ID}_pagination": "true",
+        f"{RESULT_TABLE_ID}_first": str(first),
+        f"{RESULT_TABLE_ID}_rows": str(rows),
+        f"{RESULT_TABLE_ID}_skipChildren": "true",
+        f"{RESULT_TABLE_ID}_encodeFeature": "true",
+        "ergebnissForm": "ergebnissForm",
+        "javax.faces.ViewState": f"{page['view_state']}",
+    }
+    return result_form_url(page, base_url), data
+
+
+def parse_partial_response(content, page):
+    """
+    Apply the partial response of a pagination request to page and return
+    the page with the new rows and ViewState.
+    """
+    root = etree.fromstring(content, etree.XMLParser(recover=True))
+    rows_html = ""
+    view_state = page["view_state"]
+    if root is not None:
+        for update in root.iter("update"):
+            if update.get("id") == RESULT_TABLE_ID:
+                rows_html = update.text or ""
+            elif "javax.faces.ViewState" in (update.get("id") or ""):
+                view_state = update.text
+
+    table = f'<table><tbody id="{RESULT_TABLE_ID}_data">{rows_html}</tbody></table>'
+    return {
+        "action": page["action"],
+        "view_state": view_state,
+        "rows": parse_search_results(table)["rows"] or [],
+    }
+
+
+def document_file_path(company_name, row=None, used=None):
+    """
+    Path of a downloaded SI document. Without a result row this is the
+    former files/{company_name}.xml; with a row the register cell (court and
+    register number) is appended, so every registration of a search gets a
+    stable name of its own. used collects the paths handed out for one search.
+    """
+    company_name = str(company_name).replace('/', '')
+    if row is None:
+        return f"files/{company_name}.xml"
+
+    register = row["cells"][1] if len(row["cells"]) > 1 else ""
+    register = re.sub(r"[^\w.-]+", "_", register).strip("_") or f"row{row['data_ri']}"
+    file_path = f"files/{company_name}__{register}.xml"
+    if used is not None:
+        if file_path in used:
+            file_path = f"files/{company_name}__{register}_{row['data_ri']}.xml"
+        used.add(file_path)
+    return file_path
+
+
+def result_row_key(row):
+    """
+    Stable key of a result row: its register cell, or the row index.
+    """
+    register = row["cells"][1] if len(row["cells"]) > 1 else ""
+    return register or f"row{row['data_ri']}"
+
+
+def restore_documents_from_cache(cache, schlagwoerter, schlagwort_option):
+    """
+    Write the documents of a cached --all-results search back to files/ and
+    return their paths, or None unless the list and every document are cached.
+    """
+    listing = cache.get("list", schlagwoerter, schlagwort_option)
+    if listing is None:
+        return None
+    entries = json.loads(listing)
+    cached_paths = [cache.lookup("xml", f"{schlagwoerter}\0{row_key}", schlagwort_option) for row_key, _ in entries]
+    if any(path is None for path in cached_paths):
+        return None
+    return [copy_document(cached_path, file_path) for (_, file_path), cached_path in zip(entries, cached_paths)]
 
-        return results
+
+class DownloadError(Exception):
+    """
+    Raised when a request still fails after all retries. The error_class of
+    this and the subclasses below picks the retry policy of the company;
+    errors marked retried already had their retries and fail the company.
+    """
+    error_class = "network"
+    retried = False
+
+
+class ThrottledError(DownloadError):
+    """
+    The portal answered 429 or 503.
+    """
+    error_class = "throttled"
+
+
+class NoResultError(DownloadError):
+    """
+    The search found no company to download the SI document of.
+    """
+    error_class = "no_result"
+
+
+class InvalidDocumentError(DownloadError):
+    """
+    A downloaded document is not XML (e.g. an HTML error page) or too large.
+    """
+    error_class = "invalid_xml"
+
+
+# Classes of per-company failures with their default (retries, backoff
+# seconds); a company is retried after backoff * 2 ** attempt seconds
+ERROR_CLASSES = ("network", "throttled", "no_result", "invalid_xml", "error")
+DEFAULT_RETRY_POLICY = {
+    "network": (3, 5.0),
+    "throttled": (5, 30.0),
+    "no_result": (0, 0.0),
+    "invalid_xml": (1, 10.0),
+    "error": (0, 0.0),
+}
+
+# Upper bound of a downloaded SI document (--max-document-mb)
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+
+def classify_error(error):
+    """
+    Map an exception of the search and download of a company to one of
+    ERROR_CLASSES.
+    """
+    error_class = getattr(error, "error_class", None)
+    if error_class in ERROR_CLASSES:
+        return error_class
+    # urllib/mechanize errors carry .code, requests errors .response
+    status = getattr(error, "code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = error.response.status_code
+    if status in (429, 503):
+        return "throttled"
+    if isinstance(error, etree.XMLSyntaxError):
+        return "invalid_xml"
+    # Timeouts, connection errors and HTTP errors are all OSErrors
+    if isinstance(error, OSError):
+        return "network"
+    return "error"
+
+
+def parse_retry_policy(values):
+    """
+    DEFAULT_RETRY_POLICY updated with --retry values of the form
+    CLASS=RETRIES or CLASS=RETRIES:BACKOFF_SECONDS.
+    """
+    policy = dict(DEFAULT_RETRY_POLICY)
+    for value in values or []:
+        error_class, _, setting = value.partition("=")
+        retries, _, backoff = setting.partition(":")
+        if error_class not in policy or not retries.isdigit():
+            raise ValueError(f"Invalid --retry {value!r}, expected CLASS=RETRIES[:SECONDS] with CLASS one of {', '.join(ERROR_CLASSES)}")
+        policy[error_class] = (int(retries), float(backoff) if backoff else policy[error_class][1])
+    return policy
+
+
+def retry_delay(policy, error_class, attempt):
+    """
+    Seconds to wait before retry number attempt + 1 of a company that failed
+    with error_class, or None once its retries are used up.
+    """
+    retries, backoff = policy[error_class]
+    if attempt >= retries:
+        return None
+    return backoff * 2 ** attempt
+
+
+def validate_document(content, content_type=None, max_bytes=MAX_DOCUMENT_BYTES):
+    """
+    Raise InvalidDocumentError unless content looks like an XML document of
+    at most max_bytes, before it is written to files/ or the cache.
+    """
+    if not content:
+        raise InvalidDocumentError("Empty document")
+    if max_bytes and len(content) > max_bytes:
+        raise InvalidDocumentError(f"Document of {len(content)} bytes exceeds the limit of {max_bytes} bytes")
+    if content_type and "html" in content_type.lower():
+        raise InvalidDocumentError(f"Expected an XML document, got {content_type}")
+    head = content[:512].lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if not head.startswith(b"<") or head.startswith((b"<!doctype html", b"<html")):
+        raise InvalidDocumentError(f"Expected an XML document, got {content[:60]!r}")
+
+
+def check_document_status(response):
+    """
+    Raise for a throttled or failed document download.
+    """
+    if response.status_code in (429, 503):
+        raise ThrottledError(f"HTTP {response.status_code} for {response.url}")
+    if response.status_code >= 400:
+        raise DownloadError(f"HTTP {response.status_code} for {response.url}")
+
+
+class DeadLetterFile:
+    """
+    Companies that failed permanently, as JSON lines (company, error class,
+    error, attempts). The file can be passed to --input to run exactly these
+    companies again.
+
+    The failures of the run are collected in {filepath}.partial and only
+    replace filepath on close(), so a re-run never appends to the file it
+    reads and companies that succeed on the re-run drop out of it.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.partial_path = f"{filepath}.partial"
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def add(self, company, error_class, error, attempts):
+        record = {
+            "time": time.time(), "company": str(company), "error_class": error_class,
+            "error": f"{type(error).__name__}: {error}", "attempts": attempts,
+        }
+        with self.lock:
+            # The first failure truncates what an interrupted run left behind
+            with open(self.partial_path, "a" if self.count else "w", encoding="utf-8") as file:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.count += 1
+
+    def close(self):
+        """
+        Replace filepath with the failures of this run, or remove it if
+        every company succeeded.
+        """
+        with self.lock:
+            if self.count:
+                os.replace(self.partial_path, self.filepath)
+            elif os.path.exists(self.filepath):
+                os.remove(self.filepath)
+
+
+# Read size of the streamed document downloads, the most a worker holds of a body
+DOCUMENT_CHUNK_BYTES = 64 * 1024
+
+
+def file_sha256(filepath):
+    """
+    SHA-256 of a file, hashed from a read-only memory map without copying it.
+    """
+    with open(filepath, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return hashlib.sha256(buffer).hexdigest()
+
+
+def install_document(tmp_path, file_path, sha256):
+    """
+    Move the completely written tmp_path to file_path, unless file_path
+    already holds the same document (it is then not written again).
+    """
+    if os.path.exists(file_path) and os.path.getsize(file_path) == os.path.getsize(tmp_path) \
+            and file_sha256(file_path) == sha256:
+        METRICS.count("documents_unchanged")
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, file_path)
+    return file_path
+
+
+def stream_document(response, file_path, max_bytes=MAX_DOCUMENT_BYTES, chunk_size=DOCUMENT_CHUNK_BYTES):
+    """
+    Write the body of a document response requested with stream=True to
+    file_path chunk by chunk, so a worker holds at most one chunk of it
+    whatever the document size. The status, content type and first chunk
+    are checked before anything is written and the size while streaming;
+    the file only replaces file_path once complete. Returns its size.
+    """
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        check_document_status(response)
+        length = response.headers.get("Content-Length")
+        if max_bytes and length and length.isdigit() and int(length) > max_bytes:
+            raise InvalidDocumentError(f"Document of {length} bytes exceeds the limit of {max_bytes} bytes")
+        with open(tmp_path, "wb") as file:
+            for chunk in response.iter_content(chunk_size):
+                if not chunk:
+                    continue
+                if size == 0:
+                    validate_document(chunk, response.headers.get("Content-Type"), max_bytes=0)
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise InvalidDocumentError(f"Document exceeds the limit of {max_bytes} bytes")
+                digest.update(chunk)
+                file.write(chunk)
+        if size == 0:
+            raise InvalidDocumentError("Empty document")
+        install_document(tmp_path, file_path, digest.hexdigest())
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    finally:
+        response.close()
+    return size
+
+
+def copy_document(source_path, file_path):
+    """
+    Copy a cached SI document to file_path, file to file.
+    """
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    shutil.copyfile(source_path, tmp_path)
+    return install_document(tmp_path, file_path, file_sha256(tmp_path))
 
 
 class HandelsRegister:
-    def __init__(self, args):
+    def __init__(self, args, cache=None):
+        import mechanize
+        import requests
+
         self.args = args
         self.xml_parser = None  # init xml_parser
         self.browser = mechanize.Browser()
@@ -116,163 +1051,199 @@ class HandelsRegister:
         self.browser.set_handle_redirect(True)
         self.browser.set_handle_referer(True)
 
-        self.browser.addheaders = [
-            (
-                "User-Agent",
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.5 Safari/605.1.15",
-            ),
-            ("Accept-Language", "en-GB,en;q=0.9"),
-            ("Accept-Encoding", "gzip, deflate, br"),
-            (
-                "Accept",
-                "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-            ),
-            ("Connection", "keep-alive"),
-        ]
+        self.browser.addheaders = list(BROWSER_HEADERS)
 
-        self.cachedir = pathlib.Path("cache")
-        self.cachedir.mkdir(parents=True, exist_ok=True)
+        # Keep-alive session for the document downloads, reused across companies
+        self.session = requests.Session()
+        self.last_used = time.monotonic()
 
-    def open_startpage(self):
-        self.browser.open("https://www.handelsregister.de/rp_web/welcome.xhtml", timeout=10)
+        self.cache = cache if cache is not None else ResultCache(
+            args.cache_dir, ttl=args.cache_ttl * 3600, max_bytes=args.cache_max_mb * 1024 * 1024)
+        self.schlagwoerter = args.schlagwoerter
+        self.search_from_cache = False
+        self.warmed = False
+        self.max_document_bytes = int(args.max_document_mb * 1024 * 1024)
+        # Seconds a request may stall before it fails as a network error
+        self.timeout = args.timeout
 
-    def companyname2cachename(self, companyname):
-        return self.cachedir / companyname
+    def close(self):
+        """
+        Close the browser and the sockets of the download session.
+        """
+        self.browser.close()
+        self.session.close()
 
-    def search_company(self):
-        cachename = self.companyname2cachename(self.args.schlagwoerter)
+    def open_startpage(self):
+        with METRICS.timer("open_startpage"):
+            response = self.browser.open(f"{self.args.base_url}/welcome.xhtml", timeout=self.timeout)
+        METRICS.response("open_startpage", response.code, len(response.get_data()))
+        self.warmed = True
+        self.last_used = time.monotonic()
+
+    def search_company(self, schlagwoerter=None, use_cache=True):
+        import mechanize
+
+        if schlagwoerter is None:
+            schlagwoerter = self.args.schlagwoerter
+        self.schlagwoerter = schlagwoerter
         cookie_dict = {}  # Initialize cookie_dict 
 
-        # Check if the cache file exists
-        if cachename.exists():
-            try:
-                # Delete the existing cache file
-                os.remove(cachename)
-                print(f"Deleted existing cache file: {cachename}")
-            except Exception as e:
-                print(f"Error while deleting file {cachename}: {e}")
-
-        if self.args.force == False and cachename.exists():
-            with open(cachename, "r") as f:
-                html = f.read()
-                print("return cached content for %s" % self.args.schlagwoerter)
+        html = None
+        if use_cache and not self.args.force:
+            html = self.cache.get("html", schlagwoerter, self.args.schlagwortOptionen)
+        self.search_from_cache = html is not None
+
+        if html is not None:
+            html = html.decode("utf-8")
+            print("return cached content for %s" % schlagwoerter)
         else:
-            response = self.browser.open("https://www.handelsregister.de/rp_web/erweitertesuche.xhtml")
+            if not self.warmed:
+                self.open_startpage()
+            with METRICS.timer("search_form"):
+                response = self.browser.open(f"{self.args.base_url}/erweitertesuche.xhtml", timeout=self.timeout)
+            METRICS.response("search_form", response.code, len(response.get_data()))
             if self.args.debug:
                 print(self.browser.title())
 
-            self.browser.select_form(name="form")
+            try:
+                self.browser.select_form(name="form")
+            except mechanize.FormNotFoundError:
+                # The portal answered with an error or maintenance page
+                raise DownloadError(f"Search form not found on {self.args.base_url}/erweitertesuche.xhtml")
 
-            self.browser["form:schlagwoerter"] = self.args.schlagwoerter
+            self.browser["form:schlagwoerter"] = schlagwoerter
             so_id = schlagwortOptionen.get(self.args.schlagwortOptionen)
 
             self.browser["form:schlagwortOptionen"] = [str(so_id)]
 
-            response_result = self.browser.submit()
+            with METRICS.timer("search_company"):
+                response_result = self.browser.open(self.browser.click(), timeout=self.timeout)
+                html = response_result.read()
+            METRICS.response("search_company", response_result.code, len(html))
 
             if self.args.debug:
                 print(self.browser.title())
 
-            html = response_result.read().decode("utf-8")
+            html = html.decode("utf-8")
+            self.cache.put("html", schlagwoerter, self.args.schlagwortOptionen, html)
 
-            
-            # with open(cachename, "w") as f:
-            #     f.write(html)
-            
             # Capture cookies from the mechanize browser
             cookies = self.browser._ua_handlers['_cookies'].cookiejar
             cookie_dict = {cookie.name: cookie.value for cookie in cookies}
+            self.last_used = time.monotonic()
 
         return html, cookie_dict
 
-    def get_companies_xml_file(self, soup, cookies, company_name):
-        # Find the table body containing the results
-        tbody = soup.find('tbody', id='ergebnissForm:selectedSuchErgebnisFormTable_data')
-
-        if not tbody:
-            print("No results table found. This error maybe probably due to incorrect company name.")
-            return False # Exit the function if the tbody is not found
-
-        # Find the first row within the results table
-        first_row = tbody.find('tr')
-
-        if not first_row:
-            print("No rows found in the results table. This error maybe probably due to incorrect company name.")
-            return False # Exit the function if no rows are found
-            
-        # Find all <a> tags within the first row
-        a_tags = first_row.find_all('a')
-
-        # Check if any <a> tags are found
-        if not a_tags:
-            print("No <a> tags found in the first row. This error maybe probably due to incorrect company name.")
-            return False # Exit the function if no <a> tags are found
-
-        # Get the last <a> tag
-        last_a_tag = first_row.find_all('a')[-1]
-        last_a_id = last_a_tag.get('id')
-
-        # Find the form element by ID
-        form_element = soup.find('form', id='ergebnissForm')
-        action_url = form_element['action']
-        query_string = action_url.split('?')[1] if '?' in action_url else ''
-
-        # Get the ViewState value
-        view_state_element = soup.find('input', {'name': 'javax.faces.ViewState'})
-        view_state = view_state_element.get('value') if view_state_element else None
-
-        # Get the JSESSIONID cookie value
-        jsessionid_cookie = cookies.get("JSESSIONID", "")
-
-        # Construct the URL for the POST request
-        url = f"https://www.handelsregister.de/rp_web/xhtml/research/sucheErgebnisse.xhtml?{query_string}"
-
-        headers = {
-            "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-            "accept-encoding": "gzip, deflate, br, zstd",
-            "accept-language": "en-GB,en-US;q=0.9,en;q=0.8",
-            "cache-control": "max-age=0",
-            "connection": "keep-alive",
-            "content-type": "application/x-www-form-urlencoded",
-            "cookie": f"JSESSIONID={jsessionid_cookie}",
-            "host": "www.handelsregister.de",
-            "origin": "https://www.handelsregister.de",
-            "referer": "https://www.handelsregister.de/",
-            "sec-ch-ua": '"Not)A;Brand";v="99", "Google Chrome";v="127", "Chromium";v="127"',
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": '"Windows"',
-            "sec-fetch-dest": "document",
-            "sec-fetch-mode": "navigate",
-            "sec-fetch-site": "same-origin",
-            "sec-fetch-user": "?1",
-            "upgrade-insecure-requests": "1",
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36"
-        }
+    def get_companies_xml_file(self, page, cookies, company_name):
+        if not self.args.force:
+            cached_path = self.cache.lookup("xml", self.schlagwoerter, self.args.schlagwortOptionen)
+            if cached_path is not None:
+                copy_document(cached_path, document_file_path(company_name))
+                print("File taken from cache")
+                return
+
+        document_request = build_document_request(page, self.args.base_url)
+        if not document_request:
+            raise NoResultError(f"No search result for {self.schlagwoerter}")
+
+        if self.search_from_cache:
+            # The ViewState of a cached result page is no longer valid on the
+            # server, so search again before requesting the document
+            html, cookies = self.search_company(self.schlagwoerter, use_cache=False)
+            page = parse_search_results(html)
+            document_request = build_document_request(page, self.args.base_url)
+            if not document_request:
+                raise NoResultError(f"No search result for {self.schlagwoerter}")
+        url, data = document_request
+
+        # The session cookies (JSESSIONID) of the search are sent along; the
+        # document is streamed to disk instead of being held in memory
+        file_path = document_file_path(company_name)
+        with METRICS.timer("document_download"):
+            response = self.session.post(url, headers=document_headers(self.args.base_url), data=data, cookies=cookies, stream=True,
+                                         timeout=self.timeout)
+            size = stream_document(response, file_path, self.max_document_bytes)
+        METRICS.response("document_download", response.status_code, size)
+        self.cache.put_file("xml", self.schlagwoerter, self.args.schlagwortOptionen, file_path)
 
-        data = {
-            "ergebnissForm": "ergebnissForm",
-            "ergebnissForm:selectedSuchErgebnisFormTable_rppDD": "10",
-            "javax.faces.ViewState": f"{view_state}",
-            "property2": "",
-            f"{last_a_id}": f"{last_a_id}",
-            "property": "Global.Dokumentart.SI"
-        }
+        print("File downloaded successfully")
 
-        response = requests.post(url, headers=headers, data=data)
-        company_name = str(company_name).replace('/', '')
+    def get_all_companies_xml_files(self, page, cookies, company_name):
+        """
+        Download the SI document of every row of the result table, paging
+        through all its pages. The rows of a page are fetched concurrently
+        (--document-workers) with the ViewState of that page.
+        """
+        import concurrent.futures
+
+        schlagwort_option = self.args.schlagwortOptionen
+        if not self.args.force:
+            file_paths = restore_documents_from_cache(self.cache, self.schlagwoerter, schlagwort_option)
+            if file_paths is not None:
+                print(f"{len(file_paths)} files taken from cache")
+                return file_paths
+
+        if not build_document_request(page, self.args.base_url):
+            raise NoResultError(f"No search result for {self.schlagwoerter}")
+
+        if self.search_from_cache:
+            # Paging needs the table state on the server, so search again
+            html, cookies = self.search_company(self.schlagwoerter, use_cache=False)
+            page = parse_search_results(html)
+
+        page_size = len(page["rows"])
+        used_paths = set()
+        seen_rows = set()
+        entries = []
+        first = 0
+        for _ in range(MAX_RESULT_PAGES):
+            rows = [(i, row) for i, row in enumerate(page["rows"]) if row["data_ri"] not in seen_rows]
+            if not rows:
+                break
+            seen_rows.update(row["data_ri"] for _, row in rows)
+            jobs = [(i, result_row_key(row), document_file_path(company_name, row, used_paths)) for i, row in rows]
 
-        # Save the XML file
-        with open(f"files/{company_name}.xml", "wb") as file:
-            file.write(response.content)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.args.document_workers) as executor:
+                entries.extend(executor.map(
+                    lambda job: self.download_result_row(page, *job, cookies=cookies, page_size=page_size), jobs))
 
-        print("File downloaded successfully")
+            if len(page["rows"]) < page_size:
+                break
+            first += page_size
+            url, data = build_pagination_request(page, first, page_size, self.args.base_url)
+            with METRICS.timer("result_page"):
+                response = self.session.post(url, headers=ajax_headers(self.args.base_url), data=data, cookies=cookies,
+                                             timeout=self.timeout)
+            METRICS.response("result_page", response.status_code, len(response.content))
+            page = parse_partial_response(response.content, page)
+
+        entries = [entry for entry in entries if entry is not None]
+        self.cache.put("list", self.schlagwoerter, schlagwort_option, json.dumps(entries))
+        print(f"{len(entries)} files downloaded for {company_name}")
+        return [file_path for _, file_path in entries]
+
+    def download_result_row(self, page, row_index, row_key, file_path, cookies, page_size):
+        document_request = build_document_request(page, self.args.base_url, row_index, page_size)
+        if not document_request:
+            return None
+        url, data = document_request
+        with METRICS.timer("document_download"):
+            response = self.session.post(url, headers=document_headers(self.args.base_url), data=data, cookies=cookies, stream=True,
+                                         timeout=self.timeout)
+            size = stream_document(response, file_path, self.max_document_bytes)
+        METRICS.response("document_download", response.status_code, size)
+        self.cache.put_file("xml", f"{self.schlagwoerter}\0{row_key}", self.args.schlagwortOptionen, file_path)
+        return row_key, file_path
 
     def get_companies_in_searchresults(self, html, cookies, xml_file_path, company_name):
-        soup = BeautifulSoup(html, 'html.parser')
-        grid = soup.find('table', role='grid')
+        with METRICS.timer("parse_search_results"):
+            page = parse_search_results(html)
 
-        # Call the new function to download the XML file
-        self.get_companies_xml_file(soup, cookies, company_name=company_name)
+        # Call the new function to download the XML file(s)
+        if self.args.all_results:
+            self.get_all_companies_xml_files(page, cookies, company_name)
+        else:
+            self.get_companies_xml_file(page, cookies, company_name=company_name)
 
         # # Initialize XMLParser
         # self.xml_parser = XMLParser(xml_file_path)
@@ -295,10 +1266,9 @@ class HandelsRegister:
         #
         # for x in range(len(xml_data)):
         #     results = []
-        #     for result in grid.find_all('tr'):
-        #         a = result.get('data-ri')
-        #         if a is not None:
-        #             d = self.parse_result(result)
+        #     for result in page["rows"] or []:
+        #         if result["data_ri"] is not None:
+        #             d = self.parse_result_cells(result["cells"])
         #             results.append(d)
         #     results_i.append(results)
         #
@@ -314,163 +1284,1632 @@ class HandelsRegister:
         # return results_i, merged_data_i
 
     def parse_result(self, result):
-        cells = []
-        for cellnum, cell in enumerate(result.find_all('td')):
-            cells.append(cell.text.strip())
-
-        d = {
-            'court': cells[1],  # Gericht
-            'name': cells[2],  # Firmenname
-            'state': cells[3],  # Sitz
-            'status': cells[4],  # Status
-            'documents': cells[5],  # Dokumente
-            'history': [6]  # Verlauf
-        }
+        cells = [cell.text.strip() for cell in result.find_all('td')]
+        return self.parse_result_cells(cells)
+
+    @staticmethod
+    def parse_result_cells(cells):
+        """
+        Build the CompanyRecord from the stripped cell texts of a result row.
+        """
+        history = [6]  # Verlauf
 
         # Extract history if available
-        history_cells = result.find_all('td')[8:]
+        history_cells = cells[8:]
         if history_cells:
             for i in range(0, len(history_cells), 2):
-                event = history_cells[i].text.strip()
-                date = history_cells[i + 1].text.strip()
-                d['history'].append((event, date))
+                event = history_cells[i]
+                date = history_cells[i + 1]
+                history.append((event, date))
+
+        return CompanyRecord(
+            court=cells[1],  # Gericht
+            name=cells[2],  # Firmenname
+            state=cells[3],  # Sitz
+            status=cells[4],  # Status
+            documents=cells[5],  # Dokumente
+            history=history
+        )
+
+class SessionPool:
+    """
+    Fixed set of warmed HandelsRegister sessions shared by the worker threads.
+
+    Each session keeps its own browser (cookies, current ViewState) and
+    keep-alive download session, and opens the start page only once. A worker
+    checks one out for the search and download of a company and returns it.
+    Sessions that failed with one of DISCARD_ERRORS (the browser may be left
+    on an unexpected page) or sat idle for longer than max_idle seconds (the
+    server-side session may have expired) are closed and replaced by fresh
+    ones; an empty search or a throttled request keeps the session. All
+    sessions share one ResultCache.
+    """
+    DISCARD_ERRORS = ("network", "invalid_xml", "error")
+
+    def __init__(self, args, size=4, max_idle=600, cache=None):
+        self.args = args
+        self.max_idle = max_idle
+        self.cache = cache
+        self.sessions = queue.LifoQueue()
+        for _ in range(size):
+            self.sessions.put(None)  # warmed on first checkout
+
+    def new_session(self):
+        # The start page is opened with the first live search
+        return HandelsRegister(self.args, cache=self.cache)
+
+    @contextlib.contextmanager
+    def session(self):
+        h = self.sessions.get()
+        try:
+            if h is not None and time.monotonic() - h.last_used > self.max_idle:
+                h.close()
+                h = None
+            if h is None:
+                h = self.new_session()
+            yield h
+        except Exception as e:
+            if h is not None and classify_error(e) in self.DISCARD_ERRORS:
+                h.close()
+                h = None  # the session may be in an unknown state, replace it
+            raise
+        finally:
+            if h is not None:
+                h.last_used = time.monotonic()
+            self.sessions.put(h)
+
+
+def form_fields(form):
+    """
+    Return the (name, value) pairs a browser would submit for a parsed <form>,
+    including the first submit button as mechanize's submit() does.
+    """
+    fields = []
+    submit_added = False
+    for control in form.find_all(["input", "select", "textarea", "button"]):
+        name = control.get("name")
+        if not name or control.has_attr("disabled"):
+            continue
+
+        if control.name == "select":
+            options = control.find_all("option")
+            selected = [option for option in options if option.has_attr("selected")]
+            if not selected and not control.has_attr("multiple"):
+                selected = options[:1]
+            fields.extend((name, option.get("value", option.text)) for option in selected)
+        elif control.name == "textarea":
+            fields.append((name, control.text))
+        else:
+            control_type = control.get("type", "submit" if control.name == "button" else "text").lower()
+            if control_type in ("checkbox", "radio"):
+                if control.has_attr("checked"):
+                    fields.append((name, control.get("value", "on")))
+            elif control_type in ("submit", "image"):
+                if not submit_added:
+                    fields.append((name, control.get("value", "")))
+                    submit_added = True
+            elif control_type not in ("button", "reset", "file"):
+                fields.append((name, control.get("value", "")))
+    return fields
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the requests per second of all tasks together.
+    A rate of 0 or less disables the limit.
+    """
+    def __init__(self, rate, burst=1):
+        import asyncio
+
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        import asyncio
+
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncDownloader:
+    """
+    asyncio engine for the search -> result form -> SI document sequence.
+
+    At most max_sessions companies are in flight, each on its own keep-alive
+    session; all requests share one token bucket of `rate` requests per
+    second. Timeouts, connection errors, 429 and 5xx responses are retried
+    with exponential backoff (honouring Retry-After). The blocking requests
+    calls run in worker threads so no extra HTTP dependency is needed.
+    SI documents found in the cache (unless force) are not requested again.
+    A company that fails otherwise is retried as a whole according to
+    retry_policy; failed companies are recorded in the dead letter file.
+    The session of a worker is only replaced after one of
+    SessionPool.DISCARD_ERRORS.
+    """
+    def __init__(self, schlagwort_option="exact", base_url=BASE_URL, max_sessions=4, rate=1.0,
+                 burst=1, max_retries=5, backoff=1.0, timeout=30, cache=None, force=False, ledger=None,
+                 all_results=False, document_workers=2, retry_policy=None, dead_letter=None,
+                 max_document_bytes=MAX_DOCUMENT_BYTES):
+        self.schlagwort_option = schlagwort_option
+        self.all_results = all_results
+        self.document_workers = document_workers
+        self.ledger = ledger
+        self.cache = cache
+        self.force = force
+        self.base_url = base_url
+        self.max_sessions = max_sessions
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate, burst)
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.dead_letter = dead_letter
+        self.max_document_bytes = max_document_bytes
+
+    def new_session(self):
+        import requests
+
+        session = requests.Session()
+        session.headers.update(dict(BROWSER_HEADERS))
+        session.warmed = False
+        return session
+
+    async def request(self, session, method, url, stage="request", stream_to=None, **kwargs):
+        """
+        Send a request with rate limiting and retries. With stream_to the
+        body of a successful response is streamed into that file (see
+        stream_document) instead of being read into memory.
+        """
+        import asyncio
+        import requests
+
+        for attempt in range(self.max_retries + 1):
+            with METRICS.timer("rate_limit_wait"):
+                await self.limiter.acquire()
+            retry_after = None
+            status = None
+            start = time.perf_counter()
+            try:
+                response = await asyncio.to_thread(session.request, method, url, timeout=self.timeout,
+                                                   stream=stream_to is not None, **kwargs)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                error = e
+                METRICS.count("stage_errors", stage=stage, error=type(e).__name__)
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    if stream_to is not None:
+                        size = await asyncio.to_thread(stream_document, response, stream_to, self.max_document_bytes)
+                    else:
+                        size = len(response.content)
+                    METRICS.response(stage, response.status_code, size)
+                    METRICS.observe(stage, time.perf_counter() - start)
+                    response.raise_for_status()
+                    return response
+                METRICS.response(stage, response.status_code, len(response.content))
+                error = f"HTTP {response.status_code}"
+                status = response.status_code
+                retry_after = response.headers.get("Retry-After")
+
+            METRICS.observe(stage, time.perf_counter() - start)
+            if attempt == self.max_retries:
+                error_type = ThrottledError if status in (429, 503) else DownloadError
+                exhausted = error_type(f"{method} {url} failed after {attempt + 1} attempts: {error}")
+                exhausted.retried = True
+                raise exhausted
+
+            delay = self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            METRICS.count("retries", stage=stage)
+            print(f"{method} {url}: {error}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def fetch_company(self, session, company_name):
+        from bs4 import BeautifulSoup
+
+        if self.cache is not None and not self.force:
+            if self.all_results:
+                file_paths = restore_documents_from_cache(self.cache, str(company_name), self.schlagwort_option)
+                if file_paths is not None:
+                    return file_paths
+            else:
+                cached_path = self.cache.lookup("xml", str(company_name), self.schlagwort_option)
+                if cached_path is not None:
+                    return copy_document(cached_path, document_file_path(company_name))
+
+        if not session.warmed:
+            await self.request(session, "GET", f"{self.base_url}/welcome.xhtml", stage="open_startpage")
+            session.warmed = True
+
+        # Fill in and submit the extended search form
+        search_url = f"{self.base_url}/erweitertesuche.xhtml"
+        response = await self.request(session, "GET", search_url, stage="search_form")
+        soup = BeautifulSoup(response.text, 'html.parser')
+        form = soup.find('form', attrs={'name': 'form'}) or soup.find('form', id='form')
+        if form is None:
+            raise DownloadError(f"Search form not found on {search_url}")
+
+        overrides = {
+            "form:schlagwoerter": str(company_name),
+            "form:schlagwortOptionen": str(schlagwortOptionen.get(self.schlagwort_option)),
+        }
+        data = [(name, value) for name, value in form_fields(form) if name not in overrides]
+        data.extend(overrides.items())
+        action_url = urllib.parse.urljoin(response.url, form.get('action') or search_url)
+        response = await self.request(session, "POST", action_url, stage="search_company", data=data)
+        if self.cache is not None:
+            self.cache.put("html", str(company_name), self.schlagwort_option, response.content)
+
+        with METRICS.timer("parse_search_results"):
+            page = parse_search_results(response.text)
+        if self.all_results:
+            return await self.fetch_all_documents(session, page, company_name)
+
+        # Download the SI document of the first result
+        document_request = build_document_request(page, self.base_url)
+        if not document_request:
+            raise NoResultError(f"No search result for {company_name}")
+        url, data = document_request
+        file_path = document_file_path(company_name)
+        await self.request(session, "POST", url, stage="document_download", stream_to=file_path,
+                           headers=document_headers(self.base_url), data=data)
+        if self.cache is not None:
+            self.cache.put_file("xml", str(company_name), self.schlagwort_option, file_path)
+        return file_path
+
+    async def fetch_all_documents(self, session, page, company_name):
+        """
+        Page through the whole result table and download the SI document of
+        every row, at most document_workers at a time per page.
+        """
+        import asyncio
+
+        if not build_document_request(page, self.base_url):
+            raise NoResultError(f"No search result for {company_name}")
+
+        limit = asyncio.Semaphore(self.document_workers)
+
+        async def fetch_row(row_index, row_key, file_path):
+            document_request = build_document_request(page, self.base_url, row_index, page_size)
+            if not document_request:
+                return None
+            url, data = document_request
+            async with limit:
+                await self.request(session, "POST", url, stage="document_download", stream_to=file_path,
+                                   headers=document_headers(self.base_url), data=data)
+            if self.cache is not None:
+                self.cache.put_file("xml", f"{company_name}\0{row_key}", self.schlagwort_option, file_path)
+            return row_key, file_path
+
+        page_size = len(page["rows"])
+        used_paths = set()
+        seen_rows = set()
+        entries = []
+        first = 0
+        for _ in range(MAX_RESULT_PAGES):
+            rows = [(i, row) for i, row in enumerate(page["rows"]) if row["data_ri"] not in seen_rows]
+            if not rows:
+                break
+            seen_rows.update(row["data_ri"] for _, row in rows)
+            entries.extend(await asyncio.gather(*(
+                fetch_row(i, result_row_key(row), document_file_path(company_name, row, used_paths))
+                for i, row in rows
+            )))
 
-        return d
+            if len(page["rows"]) < page_size:
+                break
+            first += page_size
+            url, data = build_pagination_request(page, first, page_size, self.base_url)
+            response = await self.request(session, "POST", url, stage="result_page",
+                                          headers=ajax_headers(self.base_url), data=data)
+            page = parse_partial_response(response.content, page)
 
-def save_to_excel(companies, merged_data, filepath):
-    try:
-        # Attempt to load the existing workbook
-        if os.path.exists(filepath):
-            workbook = openpyxl.load_workbook(filepath)
-        else:
-            raise FileNotFoundError
-        
-        # Access the active sheet or create necessary sheets
-        sheet = workbook.active
-        sheet_2 = workbook["Goal output"] if "Goal output" in workbook.sheetnames else workbook.create_sheet(title="Goal output")
-    
-    except FileNotFoundError:
-        # Create a new workbook if the file doesn't exist
-        workbook = openpyxl.Workbook()
+        entries = [entry for entry in entries if entry is not None]
+        if self.cache is not None:
+            self.cache.put("list", str(company_name), self.schlagwort_option, json.dumps(entries))
+        return [file_path for _, file_path in entries]
+
+    async def worker(self, company_queue, counts):
+        import asyncio
 
-        # Create new sheets and set titles
-        sheet = workbook.active
-        sheet_2 = workbook.create_sheet(title="Goal output")
-        sheet.title = "Current output"
-        sheet_2.title = "Goal output"
+        session = self.new_session()
+        try:
+            while True:
+                company_name = await company_queue.get()
+                try:
+                    if company_name is None:
+                        return
+                    for attempt in itertools.count():
+                        if self.ledger is not None:
+                            self.ledger.start(company_name)
+                        try:
+                            with METRICS.timer("company"):
+                                file_path = await self.fetch_company(session, company_name)
+                        except Exception as e:
+                            error_class = classify_error(e)
+                            print(f"Error while downloading {company_name} ({error_class}): {e}")
+                            METRICS.count("company_errors", error_class=error_class)
+                            if self.ledger is not None:
+                                self.ledger.fail(company_name, e)
+                            if error_class in SessionPool.DISCARD_ERRORS:
+                                session.close()
+                                session = self.new_session()
+
+                            # request() already retried timeouts, 429 and 5xx
+                            delay = None if getattr(e, "retried", False) else retry_delay(self.retry_policy, error_class, attempt)
+                            if delay is None:
+                                METRICS.count("companies", status="failed")
+                                if self.dead_letter is not None:
+                                    self.dead_letter.add(company_name, error_class, e, attempt + 1)
+                                counts["failed"] += 1
+                                break
+                            METRICS.count("retries", stage="company")
+                            await asyncio.sleep(delay)
+                        else:
+                            METRICS.count("companies", status="ok")
+                            status = "downloaded" if file_path else "searched"
+                            counts[status] += 1
+                            if self.ledger is not None:
+                                self.ledger.finish(company_name, status)
+                            break
+                finally:
+                    company_queue.task_done()
+        finally:
+            session.close()
+
+    async def run(self, company_names):
+        """
+        Download the SI documents of company_names and return the number of
+        companies per outcome ("downloaded", "searched" without a document,
+        "failed"); nothing is kept per company, so memory does not grow with
+        the length of the list.
+        """
+        import asyncio
+        from tqdm import tqdm
+
+        counts = {"downloaded": 0, "searched": 0, "failed": 0}
+        company_queue = asyncio.Queue(maxsize=self.max_sessions * 2)
+        workers = [asyncio.create_task(self.worker(company_queue, counts)) for _ in range(self.max_sessions)]
+
+        with tqdm(desc="Downloading companies") as progress:
+            for company_name in company_names:
+                await company_queue.put(company_name)
+                progress.update(sum(counts.values()) - progress.n)
+            for _ in workers:
+                await company_queue.put(None)
+            await asyncio.gather(*workers)
+            progress.update(sum(counts.values()) - progress.n)
+
+        return counts
+
+
+CURRENT_OUTPUT_HEADER = ["Firmenname", "Gericht", "Sitz", "Status", "Handelsregister-Nummer", "Dokumente", "Verlauf"]
+GOAL_OUTPUT_HEADER = ["Company Name", "Court", "City", "Status", "Bezeichnung", "Rechtsform", "Straße", "Hausnummer", "Postleitzahl", "Ort", "Vorname", "Nachname", "Geschlecht", "Geburtsdatum", "Gegenstand", "Vertretungsbefugnis"]
+
+# Keys of the result dicts written to the "Current output" and "Goal output" sheets
+CURRENT_OUTPUT_KEYS = ["name", "court", "state", "status", "documents"]
+GOAL_OUTPUT_KEYS = [
+    "name", "court", "state", "status", "bezeichnung", "rechtsform", "strasse",
+    "hausnummer", "postleitzahl", "ort", "vorname", "nachname", "geschlecht",
+    "geburtsdatum", "gegenstand", "vertretungsbefugnis"
+]
+
+# "Goal output" rows are unique per company and person (first and last name,
+# so two officers sharing a first name keep their own rows) and the writers
+# update rows with the same key in place. "Current output" has no key: like
+# the sheet, it gets the search results of every run appended
+CURRENT_OUTPUT_KEY = ()
+GOAL_OUTPUT_KEY = ("name", "vorname", "nachname")
+
+
+def field_values(row, fields, default=""):
+    """
+    Values of fields, in that order, of a dict or a record.
+    """
+    if isinstance(row, dict):
+        return tuple(row.get(field, default) for field in fields)
+    return tuple(getattr(row, field, default) for field in fields)
+
+
+class BufferedResultWriter:
+    """
+    Base of the result writers used by the download pipeline.
+
+    add() takes the "Current output" and "Goal output" rows as dicts or
+    records (CompanyRecord, PersonRecord) and buffers them as tuples in
+    CURRENT_OUTPUT_KEYS / GOAL_OUTPUT_KEYS order; every flush_every
+    companies, and on close(), save() gets them as one batch. Companies are marked
+    written in the ledger once their batch is saved. Writers are not
+    thread-safe; concurrent producers go through an OutputQueue.
+    """
+    def __init__(self, target, flush_every=50, ledger=None):
+        self.target = target
+        self.flush_every = flush_every
+        self.ledger = ledger
+        self.pending_companies = 0
+        self.pending_names = []  # marked written in the ledger once saved
+        self.current_rows = []
+        self.goal_rows = []
+
+    def add(self, companies, merged_data, company_name=None):
+        for company in companies:
+            self.current_rows.append(field_values(company, CURRENT_OUTPUT_KEYS))
+        for company in merged_data:
+            self.goal_rows.append(field_values(company, GOAL_OUTPUT_KEYS))
+        METRICS.count("rows_written", len(merged_data))
+
+        self.pending_companies += 1
+        if company_name is not None:
+            self.pending_names.append(company_name)
+        if self.flush_every and self.pending_companies >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Save the buffered batch. If save() fails the batch stays buffered
+        for the next flush and its companies are not marked written.
+        Returns the error, or None once the batch is saved.
+        """
+        current_rows, goal_rows = self.current_rows, self.goal_rows
+        pending_companies = self.pending_companies
+        self.current_rows = []
+        self.goal_rows = []
+        self.pending_companies = 0
 
-        sheet.append(["Firmenname", "Gericht", "Sitz", "Status", "Handelsregister-Nummer", "Dokumente", "Verlauf"])
-        sheet_2.append(["Company Name", "Court", "City", "Status", "Bezeichnung", "Rechtsform", "Straße", "Hausnummer", "Postleitzahl", "Ort", "Vorname", "Nachname", "Geschlecht", "Geburtsdatum", "Gegenstand", "Vertretungsbefugnis"])
+        try:
+            with METRICS.timer("output_save"):
+                self.save(current_rows, goal_rows)
+        except Exception as e:
+            print(f"An error occurred while saving the results to {self.target}: {e}")
+            self.current_rows = current_rows + self.current_rows
+            self.goal_rows = goal_rows + self.goal_rows
+            self.pending_companies += pending_companies
+            return e
+
+        if self.ledger is not None:
+            for company_name in self.pending_names:
+                self.ledger.finish(company_name, "written")
+        self.pending_names = []
+        return None
 
-    except (InvalidFileException, zipfile.BadZipFile) as e:
-        print(f"Error: The file '{filepath}' is not a valid Excel file or is corrupted: {e}")
-        return
+    def save(self, current_rows, goal_rows):
+        """
+        Store one batch, or raise without keeping any of it: a failed
+        batch is passed to save() again by the next flush.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        error = self.flush()
+        if error is not None and self.ledger is not None:
+            for company_name in self.pending_names:
+                self.ledger.fail(company_name, f"Results not saved: {error}")
+        self.pending_names = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ExcelResultWriter(BufferedResultWriter):
+    """
+    Keep the result workbook in memory for a whole run.
+
+    The workbook is loaded once and the "Goal output" rows are indexed by
+    GOAL_OUTPUT_KEY, so every update-or-insert is a dict lookup.
+    The workbook is saved every flush_every companies and on close().
+    """
+    def __init__(self, filepath, flush_every=50, ledger=None):
+        super().__init__(filepath, flush_every, ledger)
+        self.filepath = filepath
+        with METRICS.timer("excel_load"):
+            self.load_workbook()
+
+    def load_workbook(self):
+        import zipfile
+        import openpyxl
+        from openpyxl.utils.exceptions import InvalidFileException
+
+        try:
+            # Attempt to load the existing workbook
+            if os.path.exists(self.filepath):
+                self.workbook = openpyxl.load_workbook(self.filepath)
+            else:
+                raise FileNotFoundError
+
+            # Access the active sheet or create necessary sheets
+            self.sheet = self.workbook.active
+            self.sheet_2 = self.workbook["Goal output"] if "Goal output" in self.workbook.sheetnames else self.workbook.create_sheet(title="Goal output")
+
+        except FileNotFoundError:
+            # Create a new workbook if the file doesn't exist
+            self.workbook = openpyxl.Workbook()
+
+            # Create new sheets and set titles
+            self.sheet = self.workbook.active
+            self.sheet_2 = self.workbook.create_sheet(title="Goal output")
+            self.sheet.title = "Current output"
+            self.sheet_2.title = "Goal output"
+
+            self.sheet.append(CURRENT_OUTPUT_HEADER)
+            self.sheet_2.append(GOAL_OUTPUT_HEADER)
+
+        except (InvalidFileException, zipfile.BadZipFile) as e:
+            print(f"Error: The file '{self.filepath}' is not a valid Excel file or is corrupted: {e}")
+            raise
+        except Exception as e:
+            print(f"An unexpected error occurred while loading the Excel file: {e}")
+            raise
+
+        # Index of the "Goal output" rows, first match wins as in the former row scan
+        self.key_columns = [GOAL_OUTPUT_KEYS.index(field) for field in GOAL_OUTPUT_KEY]
+        self.index = {}
+        for row_number, row in enumerate(self.sheet_2.iter_rows(
+                min_row=2, max_col=max(self.key_columns) + 1, values_only=True), start=2):
+            self.index.setdefault(tuple(row[column] for column in self.key_columns), row_number)
+
+    def save(self, current_rows, goal_rows):
+        # Goal rows are updated in place by key, so saving a failed batch
+        # again is harmless; the appended "Current output" rows are removed
+        first_row = self.sheet.max_row + 1
+        try:
+            self.update_sheets(current_rows, goal_rows)
+            with METRICS.timer("excel_save"):
+                self.workbook.save(self.filepath)
+        except Exception:
+            if self.sheet.max_row >= first_row:
+                self.sheet.delete_rows(first_row, self.sheet.max_row - first_row + 1)
+            raise
+        print(f"Data saved to {self.filepath}")
+
+    def update_sheets(self, current_rows, goal_rows):
+        for row in current_rows:
+            self.sheet.append(list(row))
+
+        # Add or update rows in "Goal output" sheet based on the merged_data
+        for row in goal_rows:
+            values = list(row)
+            key = tuple(values[column] for column in self.key_columns)
+            row_number = self.index.get(key)
+
+            # If the company name exists, update the existing row
+            if row_number is not None:
+                for column, value in enumerate(values[1:], start=2):
+                    self.sheet_2.cell(row=row_number, column=column).value = value
+            else:
+                # If the company name does not exist, add a new row
+                self.sheet_2.append(values)
+                self.index[key] = self.sheet_2.max_row
+
+
+def save_results(companies, merged_data, target):
+    """
+    Write the rows of a single company to the --output target.
+    """
+    try:
+        writer = open_result_writer(target, flush_every=0)
     except Exception as e:
-        print(f"An unexpected error occurred while loading the Excel file: {e}")
+        print(f"Error opening the output {target}: {e}")
         return
+    with writer:
+        writer.add(companies, merged_data)
 
 
-    for company in companies:
-        sheet.append([
-            company.get("name", ""),
-            company.get("court", ""),
-            company.get("state", ""),
-            company.get("status", ""),
-            company.get("documents", ""),
-        ])
-
-    # Add or update rows in "Goal output" sheet based on the merged_data
-    for company in merged_data:
-        name = company.get("name", "")
-        court = company.get("court", "")
-        state = company.get("state", "")
-        status = company.get("status", "")
-        bezeichnung = company.get("bezeichnung", "")
-        rechtsform = company.get("rechtsform", "")
-        strasse = company.get("strasse", "")
-        hausnummer = company.get("hausnummer", "")
-        postleitzahl = company.get("postleitzahl", "")
-        ort = company.get("ort", "")
-        vorname = company.get("vorname", "")
-        nachname = company.get("nachname", "")
-        geschlecht = company.get("geschlecht", "")
-        geburtsdatum = company.get("geburtsdatum", "")
-        gegenstand = company.get("gegenstand", "")
-        vertretungsbefugnis = company.get("vertretungsbefugnis", "")
-
-        # Check if the company name already exists in the "Goal output" sheet
-        existing_row = None
-        for row in sheet_2.iter_rows(min_row=2, values_only=False):
-            if row[0].value == name and row[10].value == vorname:  # Assuming the company name is in the first column
-                existing_row = row
-                break
+def save_to_excel(companies, merged_data, filepath):
+    """
+    Write the rows of a single company, loading and saving the workbook once.
+    """
+    try:
+        writer = ExcelResultWriter(filepath, flush_every=0)
+    except Exception:
+        return
+    writer.add(companies, merged_data)
+    writer.close()
+
+class OutputQueue:
+    """
+    Single-writer stage for the worker threads.
+
+    Workers only put (companies, merged_data, company_name) on a bounded
+    queue; one writer thread drains it in batches into the wrapped writer,
+    so the output file is never touched by more than one thread. Throughput
+    (rows/sec) and queue depth are printed every report_every seconds and
+    when the queue closes.
+    """
+    _STOP = object()
+
+    def __init__(self, writer, maxsize=1000, batch_size=100, report_every=30):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.report_every = report_every
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.rows_written = 0
+        self.started_at = time.monotonic()
+        self.last_report = self.started_at
+        self.thread = threading.Thread(target=self._drain, name="output-writer", daemon=True)
+        self.thread.start()
+
+    def add(self, companies, merged_data, company_name=None):
+        # Time spent here means the writer is the bottleneck
+        with METRICS.timer("output_queue_wait"):
+            self.queue.put((companies, merged_data, company_name))
+
+    def _drain(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            # Take whatever else is already waiting, up to one batch
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                if item is self._STOP:
+                    stop = True
+                    continue
+                companies, merged_data, company_name = item
+                try:
+                    self.writer.add(companies, merged_data, company_name)
+                    self.rows_written += len(merged_data)
+                except Exception as e:
+                    print(f"An error occurred while writing the results: {e}")
+
+            if time.monotonic() - self.last_report >= self.report_every:
+                self.report()
+
+    def report(self):
+        self.last_report = time.monotonic()
+        elapsed = self.last_report - self.started_at
+        rate = self.rows_written / elapsed if elapsed > 0 else 0.0
+        print(f"Writer: {self.rows_written} rows written, {rate:.1f} rows/sec, queue depth {self.queue.qsize()}")
+
+    def close(self):
+        self.queue.put(self._STOP)
+        self.thread.join()
+        self.writer.close()
+        self.report()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class LazyResultWriter:
+    """
+    Result writer (or OutputQueue) from open_writer(), opened on the first
+    add(): a run that hands over no rows neither creates the output nor
+    starts a writer thread. add() may be called from several threads.
+    """
+    def __init__(self, open_writer):
+        self.open_writer = open_writer
+        self.writer = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    @property
+    def opened(self):
+        return self.writer is not None
+
+    def add(self, companies, merged_data, company_name=None):
+        if self.writer is None:
+            with self.lock:
+                # An output that cannot be opened fails every company the same way
+                if self.error is not None:
+                    raise self.error
+                if self.writer is None:
+                    try:
+                        self.writer = self.open_writer()
+                    except Exception as e:
+                        self.error = e
+                        raise
+        self.writer.add(companies, merged_data, company_name)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JobLedger:
+    """
+    Persistent per-company job status in a SQLite file next to the output.
+
+    status is the last stage a company reached (searched, downloaded,
+    parsed, written); finished is set once its whole pipeline completed.
+    attempts counts the runs that started the company and last_error keeps
+    the error of the latest failed attempt. A --resume run skips finished
+    companies and retries everything else.
+    """
+    STAGES = ("pending", "searched", "downloaded", "parsed", "written")
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filepath, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                company TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pending',
+                finished INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL
+            )
+        """)
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def start(self, company):
+        self.execute("""
+            INSERT INTO jobs (company, status, finished, attempts, updated_at) VALUES (?, 'pending', 0, 1, ?)
+            ON CONFLICT(company) DO UPDATE SET
+                status = 'pending', finished = 0, attempts = attempts + 1, last_error = NULL, updated_at = excluded.updated_at
+        """, (str(company), time.time()))
+
+    def mark(self, company, status):
+        self.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE company = ?", (status, time.time(), str(company)))
+
+    def finish(self, company, status=None):
+        self.execute("""
+            UPDATE jobs SET status = COALESCE(?, status), finished = 1, last_error = NULL, updated_at = ? WHERE company = ?
+        """, (status, time.time(), str(company)))
+
+    def fail(self, company, error):
+        self.execute("UPDATE jobs SET last_error = ?, updated_at = ? WHERE company = ?", (str(error), time.time(), str(company)))
+
+    def finished_companies(self):
+        return {company for (company,) in self.execute("SELECT company FROM jobs WHERE finished = 1")}
+
+    def failed_companies(self):
+        return {company for (company,) in self.execute("SELECT company FROM jobs WHERE finished = 0 AND last_error IS NOT NULL")}
+
+    def summary(self):
+        rows = self.execute("""
+            SELECT status, finished, last_error IS NOT NULL, COUNT(*) FROM jobs GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+        """)
+        return [
+            f"{count} {status}{' (finished)' if finished else ''}{' (failed)' if failed else ''}"
+            for status, finished, failed, count in rows
+        ]
 
-        # If the company name exists, update the existing row
-        if existing_row:
-            existing_row[1].value = court
-            existing_row[2].value = state
-            existing_row[3].value = status
-            existing_row[4].value = bezeichnung
-            existing_row[5].value = rechtsform
-            existing_row[6].value = strasse
-            existing_row[7].value = hausnummer
-            existing_row[8].value = postleitzahl
-            existing_row[9].value = ort
-            existing_row[10].value = vorname
-            existing_row[11].value = nachname
-            existing_row[12].value = geschlecht
-            existing_row[13].value = geburtsdatum
-            existing_row[14].value = gegenstand
-            existing_row[15].value = vertretungsbefugnis
-        else:
-            # If the company name does not exist, add a new row
-            sheet_2.append([
-                name, court, state, status, bezeichnung, rechtsform, strasse,
-                hausnummer, postleitzahl, ort, vorname, nachname, geschlecht,
-                geburtsdatum, gegenstand, vertretungsbefugnis
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class DocumentIndex:
+    """
+    SHA-256 and PersonRecords of every document at its last --incremental
+    parse, in a SQLite file next to the downloaded files.
+
+    A document whose hash is unchanged is not parsed again; for a changed
+    one the stored rows are the previous version for diff_document_rows.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.connection = sqlite3.connect(filepath)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                file TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                rows TEXT NOT NULL,
+                updated_at REAL
+            )
+        """)
+
+    def get(self, file):
+        """
+        Return (sha256, rows) of the last parse of file, or None.
+        """
+        row = self.connection.execute("SELECT sha256, rows FROM documents WHERE file = ?", (file,)).fetchone()
+        if row is None:
+            return None
+        # Rows are stored keyed by field name, so fields added to or removed
+        # from XML_ROW_FIELDS since then come back as None or are dropped
+        return row[0], [
+            PersonRecord(**{field: values[field] for field in XML_ROW_FIELDS if field in values})
+            for values in json.loads(row[1])
+        ]
+
+    def put(self, entries):
+        """
+        Store (file, sha256, rows) entries in one transaction.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany("""
+                INSERT INTO documents (file, sha256, rows, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(file) DO UPDATE SET
+                    sha256 = excluded.sha256, rows = excluded.rows, updated_at = excluded.updated_at
+            """, [
+                (file, sha256, json.dumps([row._asdict() for row in rows], ensure_ascii=False), now)
+                for file, sha256, rows in entries
             ])
 
-    # Save workbook to Excel file
+    def close(self):
+        self.connection.close()
+
+
+def diff_document_rows(old_rows, new_rows):
+    """
+    Field-level changes between two versions of the PersonRecords of one document:
+    changed company fields (address, legal form, ...), persons added or
+    removed (identified by PERSON_KEY) and changed fields of the others.
+    """
+    changes = []
+    if old_rows and new_rows:
+        for field in COMPANY_FIELDS:
+            old, new = getattr(old_rows[0], field), getattr(new_rows[0], field)
+            if old != new:
+                changes.append({"change": "company", "field": field, "old": old, "new": new})
+
+    def person(row):
+        return {field: getattr(row, field) for field in PERSON_KEY}
+
+    old_persons = {tuple(getattr(row, field) for field in PERSON_KEY): row for row in old_rows}
+    new_persons = {tuple(getattr(row, field) for field in PERSON_KEY): row for row in new_rows}
+    for key, row in new_persons.items():
+        old_row = old_persons.get(key)
+        if old_row is None:
+            changes.append({"change": "person_added", "person": person(row), "rolle": row.rolle})
+            continue
+        for field in PERSON_FIELDS:
+            if getattr(old_row, field) != getattr(row, field):
+                changes.append({"change": "person", "person": person(row), "field": field,
+                                "old": getattr(old_row, field), "new": getattr(row, field)})
+    for key, row in old_persons.items():
+        if key not in new_persons:
+            changes.append({"change": "person_removed", "person": person(row), "rolle": row.rolle})
+    return changes
+
+
+class CsvRowSink:
+    """
+    Stream rows into a CSV file as they arrive. With append the rows are
+    added to an existing file and the header is only written to a new one.
+
+    Like all row sinks it takes rows as sequences (records or tuples) with
+    the values in fieldnames order.
+    """
+    def __init__(self, filepath, fieldnames, append=False):
+        new_file = not append or not os.path.exists(filepath) or os.path.getsize(filepath) == 0
+        self.file = open(filepath, "w" if not append else "a", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(fieldnames)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ParquetRowSink:
+    """
+    Buffer rows and write them as row groups of a Parquet file (needs pyarrow).
+    """
+    def __init__(self, filepath, fieldnames, batch_size=10000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing Parquet files requires pyarrow: pip install pyarrow")
+
+        self.pa = pa
+        self.fieldnames = fieldnames
+        self.batch_size = batch_size
+        self.schema = pa.schema([(name, pa.string()) for name in fieldnames])
+        self.writer = pq.ParquetWriter(filepath, self.schema)
+        self.buffer = []
+
+    def write(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        # Transpose the buffered rows into one list per column
+        columns = {
+            name: [None if value is None else str(value) for value in column]
+            for name, column in zip(self.fieldnames, zip(*self.buffer))
+        }
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def is_database_target(target):
+    """
+    True for a PostgreSQL URL or a SQLite file (.sqlite, .sqlite3, .db).
+    """
+    target = str(target)
+    return target.startswith(("postgresql://", "postgres://")) or \
+        pathlib.Path(target).suffix.lower() in (".sqlite", ".sqlite3", ".db")
+
+
+def is_parquet_target(target):
+    """
+    True for a Parquet file (.parquet, .pq), which is rewritten on every run.
+    """
+    return pathlib.Path(str(target)).suffix.lower() in (".parquet", ".pq")
+
+
+class SqlStore:
+    """
+    Connection to a SQLite file or, for a postgresql:// URL, a PostgreSQL
+    database (needs psycopg) with the few statements the sinks need. All
+    columns are TEXT; rows are upserted on the key columns with
+    INSERT ... ON CONFLICT DO UPDATE, which both databases support. A table
+    without key columns only has rows appended.
+    """
+    def __init__(self, target):
+        self.target = str(target)
+        self.postgres = self.target.startswith(("postgresql://", "postgres://"))
+        if self.postgres:
+            try:
+                import psycopg
+            except ImportError:
+                raise ImportError("Writing to PostgreSQL requires psycopg: pip install psycopg[binary]")
+            self.connection = psycopg.connect(self.target)
+            self.placeholder = "%s"
+        else:
+            # The writer thread of an OutputQueue uses the store created by main()
+            self.connection = sqlite3.connect(self.target, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.placeholder = "?"
+
+    @staticmethod
+    def quote(name):
+        return '"%s"' % name.replace('"', '""')
+
+    def create_table(self, table, columns, key):
+        column_sql = ", ".join(
+            f"{self.quote(column)} TEXT" + (" NOT NULL" if column in key else "") for column in columns)
+        if key:
+            key_sql = ", ".join(self.quote(column) for column in key)
+            column_sql += f", PRIMARY KEY ({key_sql})"
+        elif self.postgres:
+            # Keeps the insertion order for select(), SQLite has its rowid
+            column_sql += ", row_id BIGSERIAL"
+        self.connection.cursor().execute(f"CREATE TABLE IF NOT EXISTS {self.quote(table)} ({column_sql})")
+        self.connection.commit()
+
+    def insert(self, table, columns, rows):
+        column_sql = ", ".join(self.quote(column) for column in columns)
+        values_sql = ", ".join([self.placeholder] * len(columns))
+        self.connection.cursor().executemany(
+            f"INSERT INTO {self.quote(table)} ({column_sql}) VALUES ({values_sql})", rows)
+        self.connection.commit()
+
+    def upsert(self, table, columns, key, rows):
+        column_sql = ", ".join(self.quote(column) for column in columns)
+        values_sql = ", ".join([self.placeholder] * len(columns))
+        key_sql = ", ".join(self.quote(column) for column in key)
+        update_sql = ", ".join(
+            f"{self.quote(column)} = excluded.{self.quote(column)}" for column in columns if column not in key)
+        sql = f"INSERT INTO {self.quote(table)} ({column_sql}) VALUES ({values_sql}) ON CONFLICT ({key_sql}) "
+        sql += f"DO UPDATE SET {update_sql}" if update_sql else "DO NOTHING"
+        self.connection.cursor().executemany(sql, rows)
+        self.connection.commit()
+
+    def delete(self, table, key, keys):
+        key_sql = " AND ".join(f"{self.quote(column)} = {self.placeholder}" for column in key)
+        self.connection.cursor().executemany(f"DELETE FROM {self.quote(table)} WHERE {key_sql}", keys)
+        self.connection.commit()
+
+    def has_table(self, table):
+        cursor = self.connection.cursor()
+        if self.postgres:
+            cursor.execute("SELECT to_regclass(%s)", (table,))
+            return cursor.fetchone()[0] is not None
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        return cursor.fetchone() is not None
+
+    def select(self, table, columns, key):
+        """
+        Yield the rows of table; SQLite keeps the order in which the rows
+        were first inserted (upserts update in place), PostgreSQL sorts by key
+        or, for a table without key, by insertion.
+        """
+        if not self.postgres:
+            order_sql = "rowid"
+        else:
+            order_sql = ", ".join(self.quote(column) for column in key) if key else "row_id"
+        column_sql = ", ".join(self.quote(column) for column in columns)
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT {column_sql} FROM {self.quote(table)} ORDER BY {order_sql}")
+        yield from cursor
+
+    def close(self):
+        self.connection.close()
+
+
+class SqlRowSink:
+    """
+    Buffer rows and upsert them into a table of a SQLite or PostgreSQL
+    database in batches of batch_size, keyed on the key columns. With an
+    empty key the rows are appended.
+    """
+    def __init__(self, target, fieldnames, table, key, batch_size=1000):
+        self.store = SqlStore(target)
+        self.fieldnames = list(fieldnames)
+        self.table = table
+        self.key = tuple(key)
+        self.batch_size = batch_size
+        self.buffer = []
+        # Key columns are NOT NULL, a missing value is stored as ""
+        self.key_defaults = [("" if name in self.key else None) for name in self.fieldnames]
+        self.store.create_table(table, self.fieldnames, self.key)
+
+    def write(self, rows):
+        key_defaults = self.key_defaults
+        for row in rows:
+            self.buffer.append([
+                default if value is None else str(value) for value, default in zip(row, key_defaults)])
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.key:
+            self.store.upsert(self.table, self.fieldnames, self.key, self.buffer)
+        else:
+            self.store.insert(self.table, self.fieldnames, self.buffer)
+        self.buffer = []
+
+    def delete(self, keys):
+        """
+        Remove the rows with the given key values, after the pending upserts.
+        """
+        self.flush()
+        keys = [[value or "" for value in key] for key in keys]
+        if keys:
+            self.store.delete(self.table, self.key, keys)
+
+    def close(self):
+        self.flush()
+        self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_row_sink(filepath, fieldnames, table="rows", key=None, append=False):
+    """
+    Pick the sink for filepath: a SQLite file (.sqlite, .db) or PostgreSQL
+    URL (rows upserted into table on key, all columns by default, or appended
+    for an empty key), Parquet (.parquet) or CSV.
+    """
+    if is_database_target(filepath):
+        return SqlRowSink(filepath, fieldnames, table, fieldnames if key is None else key)
+    if is_parquet_target(filepath):
+        return ParquetRowSink(filepath, fieldnames)
+    return CsvRowSink(filepath, fieldnames, append=append)
+
+
+class RowSinkResultWriter(BufferedResultWriter):
+    """
+    Result writer on top of the row sinks, for outputs beyond what a
+    workbook handles.
+
+    In a database both sheets become tables (current_output, goal_output).
+    Like in the workbook, goal_output rows with the same key are updated in
+    place and current_output gets the rows of every run appended.
+    CSV appends the rows of every run to target and the "Current output"
+    rows to {stem}.current.csv next to it; Parquet rewrites both files.
+    """
+    def __init__(self, target, flush_every=50, ledger=None):
+        super().__init__(target, flush_every, ledger)
+        if is_database_target(target):
+            current_target = target
+        else:
+            path = pathlib.Path(target)
+            current_target = str(path.with_name(f"{path.stem}.current{path.suffix}"))
+        self.goal_sink = open_row_sink(target, GOAL_OUTPUT_KEYS, "goal_output", GOAL_OUTPUT_KEY, append=True)
+        self.current_sink = open_row_sink(current_target, CURRENT_OUTPUT_KEYS, "current_output", CURRENT_OUTPUT_KEY, append=True)
+
+    def save(self, current_rows, goal_rows):
+        # The keyed goal rows first: if the append-only current rows then
+        # fail, saving the batch again only updates the goal rows
+        for sink, rows in ((self.goal_sink, goal_rows), (self.current_sink, current_rows)):
+            try:
+                sink.write(rows)
+                if hasattr(sink, "flush"):
+                    sink.flush()
+            except Exception:
+                if hasattr(sink, "buffer"):
+                    sink.buffer = []
+                raise
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.current_sink.close()
+            self.goal_sink.close()
+
+
+def open_result_writer(target, flush_every=50, ledger=None):
+    """
+    Pick the result writer for the --output target: the workbook for .xlsx,
+    a row sink (database, Parquet, CSV) otherwise.
+    """
+    if not is_database_target(target) and pathlib.Path(target).suffix.lower() in (".xlsx", ".xlsm"):
+        return ExcelResultWriter(target, flush_every=flush_every, ledger=ledger)
+    return RowSinkResultWriter(target, flush_every=flush_every, ledger=ledger)
+
+
+# Tables of a result database exported by export_xlsx, as (table, sheet title, columns, header, key)
+EXPORT_SHEETS = [
+    ("current_output", "Current output", CURRENT_OUTPUT_KEYS, CURRENT_OUTPUT_HEADER, CURRENT_OUTPUT_KEY),
+    ("goal_output", "Goal output", GOAL_OUTPUT_KEYS, GOAL_OUTPUT_HEADER, GOAL_OUTPUT_KEY),
+    ("xml_rows", "XML rows", XML_ROW_FIELDS, XML_ROW_FIELDS, XML_ROW_KEY),
+]
+
+
+def export_xlsx(source, xlsx_path):
+    """
+    Write the result tables of the SQLite/PostgreSQL database source into a
+    new workbook with the sheets of the Excel output, streaming the rows.
+    """
+    import openpyxl
+
+    store = SqlStore(source)
+    try:
+        workbook = openpyxl.Workbook(write_only=True)
+        row_count = 0
+        for table, title, columns, header, key in EXPORT_SHEETS:
+            if not store.has_table(table):
+                continue
+            sheet = workbook.create_sheet(title)
+            sheet.append(header)
+            for row in store.select(table, columns, key):
+                sheet.append(list(row))
+                row_count += 1
+        if not workbook.worksheets:
+            print(f"No result tables found in {source}")
+            return 0
+        workbook.save(xlsx_path)
+    finally:
+        store.close()
+    print(f"{row_count} rows exported from {source} to {xlsx_path}")
+    return row_count
+
+
+def parse_xml_file(xml_file_path):
+    """
+    Parse one downloaded XJustiz file and return its PersonRecords tagged with the file name,
+    or None if the file cannot be parsed (unlike [] for a document without persons).
+    Runs inside the worker processes of parse_xml_files, so it must not raise.
+    """
+    xml_parser = XMLParser(xml_file_path)
     try:
-        workbook.save(filepath)
-        print(f"Data saved to {filepath}")
+        rows = list(xml_parser.iter_xml_data(XJUSTIZ_NAMESPACES))
     except Exception as e:
-        print(f"An error occurred while saving the Excel file: {e}")
+        print(f"Error parsing XML file {xml_file_path}: {e}")
+        return None
 
-def parse_args(default_schlagwoerter):
-    parser = argparse.ArgumentParser(description='A handelsregister CLI')
-    parser.add_argument(
+    file_name = os.path.basename(xml_file_path)
+    return [row._replace(file=file_name) for row in rows]
+
+
+def timed_parse_xml_file(xml_file_path):
+    """
+    parse_xml_file returning (seconds, rows); the worker processes cannot
+    record into the METRICS of the parent.
+    """
+    start = time.perf_counter()
+    rows = parse_xml_file(xml_file_path)
+    return time.perf_counter() - start, rows
+
+
+def parse_xml_files(files_dir, output_path, workers=None, chunksize=8, index_path=None, changes_path=None):
+    """
+    Parse every *.xml file in files_dir on a process pool and stream the rows
+    into output_path (CSV, Parquet for a .parquet path, or the xml_rows table
+    of a SQLite file or PostgreSQL URL). No network access.
+
+    With index_path (incremental mode) only documents whose SHA-256 differs
+    from the DocumentIndex are parsed, and only those whose rows changed are
+    written: CSV is appended to, databases get the rows of removed persons
+    deleted. New and changed documents are appended to changes_path as JSON
+    lines, the changes listed field by field. A Parquet file cannot be
+    appended to, so incremental mode raises ValueError for one.
+
+    Files that fail to parse are counted and skipped: their rows in the
+    output and their index entry are left as they were, so the next
+    incremental run parses them again.
+    """
+    import concurrent.futures
+    from tqdm import tqdm
+
+    if index_path and is_parquet_target(output_path):
+        raise ValueError(f"Incremental parsing cannot update the Parquet file {output_path}, use a CSV or database output")
+
+    xml_files = sorted(str(path) for path in pathlib.Path(files_dir).glob("*.xml"))
+    if not xml_files:
+        print(f"No XML files found in {files_dir}")
+        return 0
+
+    index = DocumentIndex(index_path) if index_path else None
+    previous = {}
+    hashes = {}
+    if index is not None:
+        changed_files = []
+        for xml_file in xml_files:
+            with METRICS.timer("document_hash"):
+                sha256 = file_sha256(xml_file)
+            stored = index.get(os.path.basename(xml_file))
+            if stored is not None and stored[0] == sha256:
+                METRICS.count("documents", status="unchanged")
+                continue
+            hashes[xml_file] = sha256
+            previous[xml_file] = stored
+            changed_files.append(xml_file)
+        print(f"{len(changed_files)} of {len(xml_files)} files are new or changed")
+        xml_files = changed_files
+
+    row_count = 0
+    failed = 0
+    index_entries = []
+    change_records = []
+    with open_row_sink(output_path, XML_ROW_FIELDS, "xml_rows", XML_ROW_KEY, append=index is not None) as sink:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(timed_parse_xml_file, xml_files, chunksize=chunksize)
+            for xml_file, (seconds, rows) in tqdm(zip(xml_files, results), desc="Parsing XML files", total=len(xml_files)):
+                METRICS.observe("xml_parse", seconds)
+                if rows is None:
+                    METRICS.count("documents", status="failed")
+                    failed += 1
+                    continue
+                if index is not None:
+                    stored = previous[xml_file]
+                    file_name = os.path.basename(xml_file)
+                    index_entries.append((file_name, hashes[xml_file], rows))
+                    if stored is None:
+                        METRICS.count("documents", status="new")
+                        change_records.append({"file": file_name, "status": "new", "sha256": hashes[xml_file], "persons": len(rows)})
+                    else:
+                        changes = diff_document_rows(stored[1], rows)
+                        if not changes:
+                            # Only the bytes changed (e.g. a timestamp), the rows are the same
+                            METRICS.count("documents", status="unchanged")
+                            continue
+                        METRICS.count("documents", status="changed")
+                        change_records.append({
+                            "file": file_name, "status": "changed", "sha256": hashes[xml_file],
+                            "previous_sha256": stored[0], "changes": changes,
+                        })
+                        # Rows are keyed on the company name too, so a renamed
+                        # company replaces all its rows
+                        if any(change.get("field") == "bezeichnung" for change in changes):
+                            removed = [tuple(getattr(row, field) for field in XML_ROW_KEY) for row in stored[1]]
+                        else:
+                            bezeichnung = stored[1][0].bezeichnung if stored[1] else None
+                            removed = [
+                                (bezeichnung, change["person"]["vorname"], change["person"]["nachname"])
+                                for change in changes if change["change"] == "person_removed"
+                            ]
+                        if removed and hasattr(sink, "delete"):
+                            sink.delete(removed)
+
+                with METRICS.timer("row_sink_write"):
+                    sink.write(rows)
+                row_count += len(rows)
+                METRICS.count("rows_written", len(rows))
+
+    # The index only moves on once the rows are in the output
+    if index is not None:
+        index.put(index_entries)
+        index.close()
+        if changes_path and change_records:
+            now = time.time()
+            with open(changes_path, "a", encoding="utf-8") as file:
+                for record in change_records:
+                    file.write(json.dumps({"time": now, **record}, ensure_ascii=False) + "\n")
+            print(f"{len(change_records)} new or changed documents recorded in {changes_path}")
+
+    print(f"{row_count} rows from {len(xml_files) - failed} files saved to {output_path}")
+    if failed:
+        print(f"{failed} files could not be parsed")
+    return row_count
+
+# Subcommands of the CLI; a command line without one runs fetch
+COMMANDS = ("fetch", "parse", "export")
+
+
+def parse_args(default_schlagwoerter, argv=None):
+    """
+    Parse the command line once for the whole run; the resulting args are
+    handed to the workers.
+
+    fetch searches and downloads the companies, parse reads the downloaded
+    XML files offline and export turns a result database into a workbook.
+    Without a command fetch is assumed, and --parse-files selects parse, so
+    the command lines of earlier versions keep working.
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in COMMANDS + ("-h", "--help"):
+        command = "parse" if "--parse-files" in argv else "fetch"
+        argv = [command] + [arg for arg in argv if arg != "--parse-files"]
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
         "-d", 
         "--debug", 
         help="Enable debug mode and activate logging", 
         action="store_true"
     )
-    parser.add_argument(
+    common.add_argument(
+        "--metrics",
+        help="Write per-stage latencies and counters to this file at the end of the run: a Prometheus textfile for *.prom, JSON lines (appended) otherwise",
+        default=None
+    )
+
+    parser = argparse.ArgumentParser(description='A handelsregister CLI')
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser = commands.add_parser("fetch", parents=[common], help="Search and download the companies from handelsregister.de")
+    fetch_parser.add_argument(
         "-f", 
         "--force", 
         help="Force a fresh pull and skip the cache", 
         action="store_true"
     )
-    parser.add_argument(
+    fetch_parser.add_argument(
         "-s", 
         "--schlagwoerter", 
         help="Search for the provided keywords", 
         default=default_schlagwoerter
     )
-    parser.add_argument(
+    fetch_parser.add_argument(
         "-so", 
         "--schlagwortOptionen", 
         help="Keyword options: all=contain all keywords; min=contain at least one keyword; exact=contain the exact company name.", 
         choices=["all", "min", "exact"], 
         default="exact"
     )
-    parser.add_argument(
+    fetch_parser.add_argument(
         "-o", 
         "--output", 
-        help="Path to the output Excel file", 
+        help="Output of the results: an Excel file (.xlsx), CSV, Parquet (.parquet), SQLite file (.sqlite, .db) or postgresql:// URL", 
         default="handelsregister_result.xlsx"
     )
-    args = parser.parse_args()
+    fetch_parser.add_argument(
+        "--cache-dir",
+        help="Directory of the search result and SI document cache",
+        default="cache"
+    )
+    fetch_parser.add_argument(
+        "--cache-ttl",
+        help="Hours after which cached search results and documents are fetched again (0 = never expire)",
+        type=float,
+        default=168
+    )
+    fetch_parser.add_argument(
+        "--cache-max-mb",
+        help="Size limit of the cache directory in MB; least recently used entries are removed (0 = no limit)",
+        type=float,
+        default=500
+    )
+    fetch_parser.add_argument(
+        "--all-results",
+        help="Download the SI document of every result row on every result page, not only the first row",
+        action="store_true"
+    )
+    fetch_parser.add_argument(
+        "--document-workers",
+        help="Concurrent document downloads per result page with --all-results",
+        type=int,
+        default=2
+    )
+    fetch_parser.add_argument(
+        "--engine",
+        help="Download engine: threads (mechanize, one thread per session) or async (rate limited with retries)",
+        choices=["threads", "async"],
+        default="threads"
+    )
+    fetch_parser.add_argument(
+        "--rate",
+        help="Maximum requests per second to handelsregister.de for the async engine (0 = unlimited)",
+        type=float,
+        default=1.0
+    )
+    fetch_parser.add_argument(
+        "--max-retries",
+        help="Retries with exponential backoff on timeouts, 429 and 5xx responses (async engine)",
+        type=int,
+        default=5
+    )
+    fetch_parser.add_argument(
+        "--base-url",
+        help="Base URL of the register portal, e.g. a local stub server for testing",
+        default=BASE_URL
+    )
+    fetch_parser.add_argument(
+        "--sessions",
+        help="Number of pooled handelsregister.de sessions (and worker threads)",
+        type=int,
+        default=4
+    )
+    fetch_parser.add_argument(
+        "-i",
+        "--input",
+        help="Company names: first column of an .xlsx or .csv file (with header row), a dead letter .jsonl file, or '-' for one name per line on stdin",
+        default="company_names.xlsx"
+    )
+    fetch_parser.add_argument(
+        "--flush-every",
+        help="Save the output Excel file after this many companies (and once at the end)",
+        type=int,
+        default=50
+    )
+    fetch_parser.add_argument(
+        "--queue-size",
+        help="Maximum number of companies waiting for the output writer",
+        type=int,
+        default=1000
+    )
+    fetch_parser.add_argument(
+        "--ledger",
+        help="Path of the SQLite job ledger (default: next to the output file)",
+        default=None
+    )
+    fetch_parser.add_argument(
+        "--retry",
+        help="Retries of a failed company per error class (network, throttled, no_result, invalid_xml, error), "
+             "with the backoff in seconds doubling per retry, e.g. --retry throttled=8:60; may be repeated",
+        metavar="CLASS=RETRIES[:SECONDS]",
+        action="append",
+        default=[]
+    )
+    fetch_parser.add_argument(
+        "--dead-letter",
+        help="JSON lines file of the companies that failed permanently (default: next to the output file); pass it to --input to run them again",
+        default=None
+    )
+    fetch_parser.add_argument(
+        "--timeout",
+        help="Seconds before a stalled request to handelsregister.de fails and is retried as a network error",
+        type=float,
+        default=30
+    )
+    fetch_parser.add_argument(
+        "--max-document-mb",
+        help="Downloaded SI documents larger than this are rejected",
+        type=float,
+        default=MAX_DOCUMENT_BYTES / (1024 * 1024)
+    )
+    fetch_parser.add_argument(
+        "--resume",
+        help="Skip companies the job ledger lists as finished and retry the rest",
+        action="store_true"
+    )
+    fetch_parser.add_argument(
+        "--export-xlsx",
+        help="After the run, export the SQLite/PostgreSQL output (-o) to this Excel file",
+        default=None
+    )
+    fetch_parser.add_argument(
+        "--profile",
+        help="Profile the search, download and write of this single company and exit",
+        metavar="COMPANY",
+        default=None
+    )
+    fetch_parser.add_argument(
+        "--profiler",
+        help="Profiler used by --profile (pyinstrument must be installed separately)",
+        choices=["cprofile", "pyinstrument"],
+        default="cprofile"
+    )
+    fetch_parser.add_argument(
+        "--profile-output",
+        help="File for the --profile results (default: profile.prof with cProfile, profile.html with pyinstrument)",
+        default=None
+    )
+
+    parse_parser = commands.add_parser("parse", parents=[common], help="Parse the already downloaded XML files, without network access")
+    parse_parser.add_argument(
+        "--files-dir",
+        help="Directory with the downloaded XML files",
+        default="files"
+    )
+    parse_parser.add_argument(
+        "--parse-output",
+        help="Output of the parsed rows: a CSV, Parquet (.parquet) or SQLite file (.sqlite, .db), or a postgresql:// URL",
+        default="handelsregister_result.csv"
+    )
+    parse_parser.add_argument(
+        "--workers",
+        help="Number of worker processes (default: number of CPUs)",
+        type=int,
+        default=None
+    )
+    parse_parser.add_argument(
+        "--chunksize",
+        help="Number of XML files handed to a worker process at once",
+        type=int,
+        default=8
+    )
+    parse_parser.add_argument(
+        "--incremental",
+        help="Only parse and write the documents that changed since the last incremental run",
+        action="store_true"
+    )
+    parse_parser.add_argument(
+        "--document-index",
+        help="SQLite file with the hashes and rows of the parsed documents for --incremental (default: documents.sqlite in --files-dir)",
+        default=None
+    )
+    parse_parser.add_argument(
+        "--changes",
+        help="File the --incremental change feed is appended to as JSON lines",
+        default="handelsregister_changes.jsonl"
+    )
+    parse_parser.add_argument(
+        "--export-xlsx",
+        help="After the run, export the SQLite/PostgreSQL output (--parse-output) to this Excel file",
+        default=None
+    )
+
+    export_parser = commands.add_parser("export", parents=[common], help="Export a SQLite/PostgreSQL result database to an Excel file")
+    export_parser.add_argument(
+        "source",
+        help="SQLite file (.sqlite, .db) or postgresql:// URL written by fetch or parse"
+    )
+    export_parser.add_argument(
+        "xlsx",
+        help="Excel file to write"
+    )
+    args = parser.parse_args(argv)
 
     if args.debug:
         import logging
@@ -480,53 +2919,394 @@ def parse_args(default_schlagwoerter):
 
     return args
 
-def process_company(company_name, xml_file_path):
-    # Get arguments with the current company name as the default schlagwoerter
-    args = parse_args(default_schlagwoerter=company_name)
+def normalize_company_name(company_name):
+    """
+    Clean a company name from the input list and return (name, dedup key).
+    The key ignores case, repeated whitespace and the '/' dropped from the
+    file name of the downloaded document, so names that would end up in the
+    same files/{company_name}.xml are searched only once.
+    """
+    if company_name is None:
+        return None, None
+    name = " ".join(str(company_name).split())
+    if not name:
+        return None, None
+    return name, name.replace('/', '').casefold()
+
+
+def open_company_names(path):
+    """
+    Open the company name list at path and return an iterator that reads the
+    names lazily, normalised and without duplicates.
+
+    The names are taken from the first column of an .xlsx file (openpyxl
+    read-only mode) or a .csv file, the first row being the header, from the
+    "company" of every line of a .jsonl dead letter file, or one per line
+    from stdin if path is "-". Errors opening the source are raised
+    here, before the first name is read.
+    """
+    if path == "-":
+        names = (line.rstrip("\n") for line in sys.stdin)
+    elif pathlib.Path(path).suffix.lower() == ".jsonl":
+        jsonl_file = open(path, encoding="utf-8")
+
+        def read_jsonl():
+            with jsonl_file:
+                for line in jsonl_file:
+                    if line.strip():
+                        yield json.loads(line).get("company")
+        names = read_jsonl()
+    elif pathlib.Path(path).suffix.lower() == ".csv":
+        csv_file = open(path, newline="", encoding="utf-8-sig")
+
+        def read_csv():
+            with csv_file:
+                rows = csv.reader(csv_file)
+                next(rows, None)  # header
+                for row in rows:
+                    yield row[0] if row else None
+        names = read_csv()
+    else:
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(path, read_only=True)
+
+        def read_xlsx():
+            try:
+                for row in workbook.worksheets[0].iter_rows(min_row=2, max_col=1, values_only=True):
+                    yield row[0] if row else None
+            finally:
+                workbook.close()
+        names = read_xlsx()
+
+    def unique_names():
+        seen = set()
+        for company_name in names:
+            name, key = normalize_company_name(company_name)
+            if name is None or key in seen:
+                continue
+            seen.add(key)
+            yield name
+
+    return unique_names()
+
+
+def bounded_map(executor, fn, iterable, max_pending):
+    """
+    Like executor.map, but submits only max_pending items ahead of the
+    results being consumed, so a lazy iterable is never read in full upfront.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def process_company(args, company_name, xml_file_path, writer=None, pool=None, ledger=None):
+    if pool is None:
+        pool = SessionPool(args, size=1)
+
+    if ledger is not None:
+        ledger.start(company_name)
 
-    h = HandelsRegister(args)
-    h.open_startpage()
-    html, cookies = h.search_company()
-    companies = h.get_companies_in_searchresults(html, cookies, xml_file_path, company_name)
+    # Search and download on one warmed session of the pool
+    try:
+        with METRICS.timer("company"), pool.session() as h:
+            # Without -s the company name is the search keyword
+            html, cookies = h.search_company(args.schlagwoerter or company_name)
+            if ledger is not None:
+                ledger.mark(company_name, "searched")
+            companies = h.get_companies_in_searchresults(html, cookies, xml_file_path, company_name)
+            if ledger is not None:
+                ledger.mark(company_name, "downloaded")
+    except Exception as e:
+        if ledger is not None:
+            ledger.fail(company_name, e)
+        raise
+    METRICS.count("companies", status="ok")
+
+    # Without parsed rows the download is the last stage of this company;
+    # rows handed to the writer are marked written once the file is saved
+    queued = False
 
     # Ensure there are at least two arrays lists before proceeding
     if companies is not None:
         if len(companies) < 2:
             print(f"Insufficient data for company: {company_name}")
+            if ledger is not None:
+                ledger.finish(company_name)
             return
 
+        if ledger is not None:
+            ledger.mark(company_name, "parsed")
+
         # Process each company data
         for j in range(min(len(companies[0]), len(companies[1]))):
             try:
-                save_to_excel(companies[0][j], companies[1][j], args.output)
+                if writer is not None:
+                    writer.add(companies[0][j], companies[1][j], company_name)
+                    queued = True
+                else:
+                    save_results(companies[0][j], companies[1][j], args.output)
                 print(f"Ergebnisse wurden in der Datei {args.output} gespeichert.")
             except IndexError as e:
                 print(f"IndexError encountered while processing company: {company_name}, index {j}: {str(e)}")
                 continue
 
-def main():
+    if ledger is not None and not queued:
+        ledger.finish(company_name)
+
+def process_company_isolated(args, company_name, xml_file_path, writer=None, pool=None, ledger=None,
+                             retry_policy=None, dead_letter=None):
+    """
+    process_company for the worker threads; it never raises. A failure is
+    classified, the company retried according to retry_policy and, once its
+    retries are used up, recorded in dead_letter. Returns False then.
+    """
+    retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+    for attempt in itertools.count():
+        try:
+            process_company(args, company_name, xml_file_path, writer, pool, ledger)
+            return True
+        except Exception as e:
+            error_class = classify_error(e)
+            METRICS.count("company_errors", error_class=error_class)
+            delay = retry_delay(retry_policy, error_class, attempt)
+            if delay is None:
+                print(f"Giving up on {company_name} after {attempt + 1} attempts ({error_class}): {e}")
+                METRICS.count("companies", status="failed")
+                if dead_letter is not None:
+                    dead_letter.add(company_name, error_class, e, attempt + 1)
+                return False
+            print(f"Error while processing {company_name} ({error_class}): {e}, retrying in {delay:.1f}s")
+            METRICS.count("retries", stage="company")
+            time.sleep(delay)
+
+
+def default_output_path(output, suffix):
+    """
+    Path of a file kept next to the output, e.g. the job ledger.
+    """
+    if str(output).startswith(("postgresql://", "postgres://")):
+        return f"handelsregister_result{suffix}"
+    return str(pathlib.Path(output).with_suffix(suffix))
+
+
+def export_output(args, source):
+    if not args.export_xlsx:
+        return
+    if not is_database_target(source):
+        print(f"--export-xlsx needs a SQLite or PostgreSQL output, not {source}")
+        return
+    export_xlsx(source, args.export_xlsx)
+
+
+def profile_company(args, xml_file_path):
+    """
+    Run the single company args.profile through the thread pipeline under a
+    profiler, with no other workers competing, and print and save the profile.
+    """
+    import cProfile
+    import pstats
+
+    pool = SessionPool(args, size=1)
+    writer = LazyResultWriter(lambda: open_result_writer(args.output, flush_every=0))
+
+    def run():
+        try:
+            process_company(args, args.profile, xml_file_path, writer, pool)
+        except Exception as e:
+            # An empty search or a failed download still leaves a profile worth saving
+            print(f"Error while processing {args.profile} ({classify_error(e)}): {e}")
+        finally:
+            writer.close()
+
+    if args.profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("--profiler pyinstrument requires pyinstrument: pip install pyinstrument")
+        output = args.profile_output or "profile.html"
+        profiler = Profiler()
+        profiler.start()
+        try:
+            run()
+        finally:
+            profiler.stop()
+            print(profiler.output_text(unicode=True))
+            with open(output, "w", encoding="utf-8") as file:
+                file.write(profiler.output_html())
+            print(f"Profile saved to {output}")
+    else:
+        output = args.profile_output or "profile.prof"
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            run()
+        finally:
+            profiler.disable()
+            profiler.dump_stats(output)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+            print(f"Profile saved to {output}")
+
+
+def report_metrics(args):
+    print("Timings:")
+    for line in METRICS.summary():
+        print(f"  {line}")
+    if args.metrics:
+        try:
+            METRICS.write(args.metrics)
+            print(f"Metrics saved to {args.metrics}")
+        except OSError as e:
+            print(f"Error while writing the metrics file {args.metrics}: {e}")
+
+
+def run_parse(args):
+    # Offline parsing of the downloaded XML files does not need the company list
+    index_path = None
+    if args.incremental:
+        if is_parquet_target(args.parse_output):
+            print(f"--incremental needs a CSV, SQLite or PostgreSQL output, {args.parse_output} would be replaced "
+                  "by the changed documents only")
+            sys.exit(1)
+        index_path = args.document_index or str(pathlib.Path(args.files_dir) / "documents.sqlite")
+    parse_xml_files(args.files_dir, args.parse_output, workers=args.workers, chunksize=args.chunksize,
+                    index_path=index_path, changes_path=args.changes)
+    export_output(args, args.parse_output)
+    report_metrics(args)
+
+
+def run_export(args):
+    if not is_database_target(args.source):
+        print(f"export needs a SQLite or PostgreSQL source, not {args.source}")
+        sys.exit(1)
+    export_xlsx(args.source, args.xlsx)
+
+
+def run_fetch(args):
+    import asyncio
+    import concurrent.futures
+    from tqdm import tqdm
+
     # Define paths to your files
-    excel_file_path = pathlib.Path("company_names.xlsx")
     xml_file_path = 'files/.xml'  # Path to the XML file
 
-    # Check if the Excel file exists
-    if not excel_file_path.exists():
-        print(f"Error: Excel file {excel_file_path} does not exist.")
+    if args.profile:
+        profile_company(args, xml_file_path)
+        report_metrics(args)
+        return
+
+    # Check if the input file exists
+    if args.input != "-" and not pathlib.Path(args.input).exists():
+        print(f"Error: Input file {args.input} does not exist.")
         sys.exit(1)
-    
-    # Read the Excel file and process each company name
+
+    # The names are read lazily while the workers run
     try:
-        df = pd.read_excel(excel_file_path)
+        company_names = open_company_names(args.input)
     except Exception as e:
-        print(f"Error reading the Excel file: {e}")
+        print(f"Error reading the input file: {e}")
         sys.exit(1)
 
-    # Get the company names from the first column and start from the second row
-    company_names = df.iloc[:, 0].dropna().tolist()
+    # The ledger records how far every company got, so a --resume run can
+    # skip the finished ones
+    ledger = JobLedger(args.ledger or default_output_path(args.output, ".ledger.sqlite"))
+
+    # Companies that still fail after their retries are collected for a re-run
+    try:
+        retry_policy = parse_retry_policy(args.retry)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    dead_letter = DeadLetterFile(args.dead_letter or default_output_path(args.output, ".dead.jsonl"))
+    resume_counts = {"skipped": 0, "retried": 0}
+    if args.resume:
+        finished = ledger.finished_companies()
+        failed = ledger.failed_companies()
+
+        def unfinished(names):
+            for name in names:
+                if name in finished:
+                    resume_counts["skipped"] += 1
+                    continue
+                if name in failed:
+                    resume_counts["retried"] += 1
+                yield name
+        company_names = unfinished(company_names)
+
+    # Search pages and SI documents are shared by all sessions of the run
+    cache = ResultCache(args.cache_dir, ttl=args.cache_ttl * 3600, max_bytes=args.cache_max_mb * 1024 * 1024)
+
+    if args.engine == "async":
+        downloader = AsyncDownloader(
+            schlagwort_option=args.schlagwortOptionen,
+            base_url=args.base_url,
+            max_sessions=args.sessions,
+            rate=args.rate,
+            max_retries=args.max_retries,
+            timeout=args.timeout,
+            cache=cache,
+            force=args.force,
+            ledger=ledger,
+            all_results=args.all_results,
+            document_workers=args.document_workers,
+            retry_policy=retry_policy,
+            dead_letter=dead_letter,
+            max_document_bytes=int(args.max_document_mb * 1024 * 1024)
+        )
+        asyncio.run(downloader.run(company_names))
+        if args.resume:
+            print(f"Resumed: skipped {resume_counts['skipped']} finished companies, retried {resume_counts['retried']} failed")
+        print("Ledger: " + ", ".join(ledger.summary()))
+        dead_letter.close()
+        if dead_letter.count:
+            print(f"{dead_letter.count} companies failed permanently, see {dead_letter.filepath} (run them again with --input {dead_letter.filepath})")
+        ledger.close()
+        report_metrics(args)
+        return
+
+    # One writer keeps the workbook (or database, row files) open and saves
+    # in batches; the workers only hand their rows to the queue in front of
+    # it. Both are only opened once a company has rows to write
+    output = LazyResultWriter(lambda: OutputQueue(
+        open_result_writer(args.output, flush_every=args.flush_every, ledger=ledger), maxsize=args.queue_size))
 
     # Use ThreadPoolExecutor for parallel processing of company names
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        list(tqdm(executor.map(lambda company_name: process_company(company_name, xml_file_path), company_names), desc="Processing company names", total=len(company_names)))
+    # Each worker thread checks out one of the pooled sessions
+    pool = SessionPool(args, size=args.sessions, cache=cache)
+
+    with output, concurrent.futures.ThreadPoolExecutor(max_workers=args.sessions) as executor:
+        results = bounded_map(
+            executor,
+            lambda company_name: process_company_isolated(
+                args, company_name, xml_file_path, output, pool, ledger, retry_policy, dead_letter),
+            company_names,
+            max_pending=args.sessions * 2
+        )
+        for _ in tqdm(results, desc="Processing company names"):
+            pass
+
+    if args.resume:
+        print(f"Resumed: skipped {resume_counts['skipped']} finished companies, retried {resume_counts['retried']} failed")
+    print("Ledger: " + ", ".join(ledger.summary()))
+    dead_letter.close()
+    if dead_letter.count:
+        print(f"{dead_letter.count} companies failed permanently, see {dead_letter.filepath} (run them again with --input {dead_letter.filepath})")
+    ledger.close()
+    if output.opened:
+        export_output(args, args.output)
+    else:
+        print(f"No rows to write, {args.output} was left as it was")
+    report_metrics(args)
+
+
+def main():
+    args = parse_args(default_schlagwoerter=None)
+    {"fetch": run_fetch, "parse": run_parse, "export": run_export}[args.command](args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,268 @@
+"""
+Local stand-in for the handelsregister.de pages used by handels_register.py.
+
+It serves the start page, the extended search form, a PrimeFaces-like result
+table and synthetic XJustiz SI documents, so the download engines can be run
+offline:
+
+    python stub_server.py --port 8000 --fail-rate 0.2
+    python handels_register.py --engine async --base-url http://localhost:8000/rp_web
+
+A search for a name containing "unbekannt" returns an empty result table,
+other searches return --results rows, ten per page. Like the real table,
+the pages after the first are fetched with PrimeFaces AJAX requests, and a
+document can only be requested for a row of the page currently shown.
+With --fail-rate a share of the requests is answered with 429 or 503.
+"""
+import argparse
+import html
+import random
+import threading
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+START_PAGE = """<html><head><title>Registerportal</title></head>
+<body><a href="/rp_web/erweitertesuche.xhtml">Erweiterte Suche</a></body></html>"""
+
+SEARCH_PAGE = """<html><head><title>Erweiterte Suche</title></head><body>
+<form id="form" name="form" method="post" action="/rp_web/erweitertesuche.xhtml">
+<input type="hidden" name="form" value="form" />
+<textarea id="form:schlagwoerter" name="form:schlagwoerter"></textarea>
+<input type="radio" name="form:schlagwortOptionen" value="1" />
+<input type="radio" name="form:schlagwortOptionen" value="2" checked="checked" />
+<input type="radio" name="form:schlagwortOptionen" value="3" />
+<select name="form:ergebnisseProSeite_input"><option value="10" selected="selected">10</option><option value="25">25</option></select>
+<input type="hidden" name="javax.faces.ViewState" value="{view_state}" />
+<button id="form:btnSuche" name="form:btnSuche" type="submit">Suchen</button>
+</form></body></html>"""
+
+RESULT_ROW = """<tr data-ri="{index}" class="ui-widget-content">
+<td role="gridcell"></td>
+<td role="gridcell">{court}</td>
+<td role="gridcell"><span class="marginLeft20">{name}</span></td>
+<td role="gridcell">{city}</td>
+<td role="gridcell">aktuell</td>
+<td role="gridcell"><a id="ergebnissForm:selectedSuchErgebnisFormTable:{index}:j_idt219:0:fade_" href="#">AD</a>
+<a id="ergebnissForm:selectedSuchErgebnisFormTable:{index}:j_idt219:6:fade_" href="#">SI</a></td>
+<td role="gridcell"></td>
+</tr>"""
+
+RESULT_PAGE = """<html><head><title>Suchergebnisse</title></head><body>
+<form id="ergebnissForm" name="ergebnissForm" method="post" action="/rp_web/xhtml/research/sucheErgebnisse.xhtml?cid={cid}">
+<input type="hidden" name="ergebnissForm" value="ergebnissForm" />
+<table role="grid"><thead><tr><th>Register</th></tr></thead>
+<tbody id="ergebnissForm:selectedSuchErgebnisFormTable_data" class="ui-datatable-data">
+{rows}
+</tbody></table>
+<input type="hidden" name="javax.faces.ViewState" value="{view_state}" />
+</form></body></html>"""
+
+PERSON = """
+   <tns:beteiligung><tns:rolle><tns:rollenbezeichnung><!-- {rolle} --><code>{rolle_code}</code></tns:rollenbezeichnung></tns:rolle>
+    <tns:beteiligter><tns:beteiligtennummer>{number}</tns:beteiligtennummer><tns:auswahl_beteiligter><tns:natuerlichePerson>
+     <tns:vollerName><tns:vorname>{vorname}</tns:vorname><tns:nachname>{nachname}</tns:nachname></tns:vollerName>
+     <tns:geschlecht><!-- {geschlecht} --><code>{geschlecht_code}</code></tns:geschlecht>
+     <tns:geburt><tns:geburtsdatum>{geburtsdatum}</tns:geburtsdatum></tns:geburt>
+     <tns:anschrift><tns:ort>{wohnort}</tns:ort></tns:anschrift>
+    </tns:natuerlichePerson></tns:auswahl_beteiligter></tns:beteiligter></tns:beteiligung>"""
+
+DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<tns:nachricht.reg.0400003 xmlns:tns="http://www.xjustiz.de">
+ <tns:grunddaten><tns:verfahrensdaten>
+  <tns:instanzdaten><tns:auswahl_instanzbehoerde><tns:gericht><!-- Charlottenburg (Berlin) --><code>F1103R</code></tns:gericht></tns:auswahl_instanzbehoerde><tns:aktenzeichen>HRB {registernummer} B</tns:aktenzeichen></tns:instanzdaten>
+  <tns:beteiligung><tns:beteiligter><tns:beteiligtennummer>1</tns:beteiligtennummer><tns:auswahl_beteiligter><tns:organisation>
+   <tns:bezeichnung><tns:bezeichnung.aktuell>{name}</tns:bezeichnung.aktuell></tns:bezeichnung>
+   <tns:anschrift><tns:strasse>Hauptstraße</tns:strasse><tns:hausnummer>{hausnummer}</tns:hausnummer><tns:postleitzahl>10115</tns:postleitzahl><tns:ort>Berlin</tns:ort></tns:anschrift>
+  </tns:organisation></tns:auswahl_beteiligter></tns:beteiligter></tns:beteiligung>{persons}
+ </tns:verfahrensdaten></tns:grunddaten>
+ <tns:fachdatenRegister><tns:basisdatenRegister>
+  <tns:rechtstraeger><tns:angabenZurRechtsform><tns:rechtsform><!-- Gesellschaft mit beschränkter Haftung --><code>GmbH</code></tns:rechtsform></tns:angabenZurRechtsform></tns:rechtstraeger>
+  <tns:vertretung><tns:auswahl_vertretungsbefugnis><tns:vertretungsbefugnisFreitext>Jeder Geschäftsführer vertritt allein.</tns:vertretungsbefugnisFreitext></tns:auswahl_vertretungsbefugnis></tns:vertretung>
+  <tns:gegenstand>Handel mit Waren aller Art.</tns:gegenstand>
+ </tns:basisdatenRegister></tns:fachdatenRegister>
+</tns:nachricht.reg.0400003>
+"""
+
+
+def make_xjustiz_document(name, persons=3, seed=0):
+    """
+    Return a synthetic XJustiz SI document for company name with the given
+    number of natural persons (managing directors, Prokuristen).
+    """
+    rnd = random.Random(seed)
+    person_elements = []
+    for i in range(persons):
+        geschlecht = rnd.choice(["männlich", "weiblich"])
+        rolle, rolle_code = ("Geschäftsführer(in)", "086") if i % 3 else ("Prokurist(in)", "285")
+        person_elements.append(PERSON.format(
+            number=i + 2,
+            vorname=f"Vorname{i}",
+            nachname=f"Nachname{i}",
+            geschlecht=geschlecht,
+            rolle=rolle,
+            rolle_code=rolle_code,
+            geschlecht_code=1 if geschlecht == "männlich" else 2,
+            geburtsdatum=f"19{50 + i % 50}-{1 + i % 12:02d}-{1 + i % 28:02d}",
+            wohnort=f"Wohnort{i}",
+        ))
+    return DOCUMENT.format(
+        name=html.escape(name),
+        hausnummer=rnd.randint(1, 200),
+        registernummer=10000 + rnd.randint(0, 99999),
+        persons="".join(person_elements),
+    )
+
+
+PARTIAL_RESPONSE = """<?xml version='1.0' encoding='UTF-8'?>
+<partial-response id="j_id1"><changes><update id="ergebnissForm:selectedSuchErgebnisFormTable"><![CDATA[{rows}]]></update><update id="j_id1:javax.faces.ViewState:0"><![CDATA[{view_state}]]></update></changes></partial-response>"""
+
+PAGE_SIZE = 10
+
+
+def make_result_rows(name, first, rows):
+    return "\n".join(
+        RESULT_ROW.format(index=i, court="Berlin Amtsgericht Charlottenburg HRB %d" % (10000 + i),
+                          name=html.escape(name), city="Berlin")
+        for i in range(first, first + rows)
+    )
+
+
+def make_result_page(name, rows=1, view_state="stub", cid=1):
+    """
+    Return a search result page with rows entries for company name.
+    """
+    return RESULT_PAGE.format(cid=cid, rows=make_result_rows(name, 0, rows), view_state=view_state)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Set by serve()
+    fail_rate = 0.0
+    persons = 3
+    results = 1
+    lock = threading.Lock()
+    searches = {}  # JSESSIONID -> [last searched name, number of results, first row shown]
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type="text/html; charset=utf-8", headers=None):
+        body = body.encode("utf-8") if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def session_id(self):
+        for part in self.headers.get("Cookie", "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "JSESSIONID":
+                return value
+        return None
+
+    def maybe_fail(self):
+        if self.fail_rate and random.random() < self.fail_rate:
+            if random.random() < 0.5:
+                self.send(429, "Too Many Requests", "text/plain", {"Retry-After": "0"})
+            else:
+                self.send(503, "Service Unavailable", "text/plain")
+            return True
+        return False
+
+    def read_form(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return urllib.parse.parse_qs(self.rfile.read(length).decode("utf-8"), keep_blank_values=True)
+
+    def do_GET(self):
+        if self.maybe_fail():
+            return
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/rp_web/welcome.xhtml":
+            self.send(200, START_PAGE, headers={"Set-Cookie": f"JSESSIONID={uuid.uuid4().hex}; Path=/rp_web"})
+        elif path == "/rp_web/erweitertesuche.xhtml":
+            self.send(200, SEARCH_PAGE.format(view_state=uuid.uuid4().hex))
+        else:
+            self.send(404, "Not Found", "text/plain")
+
+    def do_POST(self):
+        form = self.read_form()
+        if self.maybe_fail():
+            return
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/rp_web/erweitertesuche.xhtml":
+            name = form.get("form:schlagwoerter", [""])[0]
+            total = 0 if "unbekannt" in name.lower() else self.results
+            with self.lock:
+                self.searches[self.session_id()] = [name, total, 0]
+            self.send(200, make_result_page(name, rows=min(total, PAGE_SIZE), view_state=uuid.uuid4().hex))
+        elif path == "/rp_web/xhtml/research/sucheErgebnisse.xhtml":
+            table = "ergebnissForm:selectedSuchErgebnisFormTable"
+            with self.lock:
+                search = self.searches.get(self.session_id())
+            if search is None:
+                self.send(200, "<html><body>Ihre Sitzung ist abgelaufen.</body></html>")
+                return
+            name, total, shown = search
+
+            if form.get(f"{table}_pagination", [""])[0] == "true":
+                first = int(form.get(f"{table}_first", ["0"])[0])
+                rows = int(form.get(f"{table}_rows", [str(PAGE_SIZE)])[0])
+                with self.lock:
+                    search[2] = first
+                body = PARTIAL_RESPONSE.format(
+                    rows=make_result_rows(name, first, max(0, min(rows, total - first))),
+                    view_state=uuid.uuid4().hex,
+                )
+                self.send(200, body, "text/xml; charset=utf-8")
+                return
+
+            # The link of a row is only decoded if the row is on the current page
+            row = None
+            for key in form:
+                if key.startswith(f"{table}:") and key.endswith(":fade_"):
+                    row = int(key.split(":")[2])
+            if (row is None or not shown <= row < min(shown + PAGE_SIZE, total)
+                    or form.get("property", [""])[0] != "Global.Dokumentart.SI"):
+                self.send(200, "<html><body>Ihre Sitzung ist abgelaufen.</body></html>")
+                return
+            document_name = name if row == 0 else f"{name} ({row})"
+            self.send(200, make_xjustiz_document(document_name, persons=self.persons, seed=row), "application/xml")
+        else:
+            self.send(404, "Not Found", "text/plain")
+
+
+def serve(host="127.0.0.1", port=8000, fail_rate=0.0, persons=3, results=1):
+    """
+    Create the stub server; call serve_forever() on the result (or run it in
+    a thread and shutdown() it when done).
+    """
+    StubHandler.fail_rate = fail_rate
+    StubHandler.persons = persons
+    StubHandler.results = results
+    return ThreadingHTTPServer((host, port), StubHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the handelsregister.de pages')
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fail-rate", help="Share of requests answered with 429/503", type=float, default=0.0)
+    parser.add_argument("--persons", help="Number of persons per SI document", type=int, default=3)
+    parser.add_argument("--results", help="Number of result rows per search", type=int, default=1)
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.fail_rate, args.persons, args.results)
+    print(f"Serving on http://{args.host}:{args.port}/rp_web")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Shared fixtures of the offline tests: XJustiz documents and a running
+stub_server.py.
+"""
+import pathlib
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import stub_server
+
+
+@pytest.fixture
+def write_document():
+    """
+    Write a stub_server XJustiz document for company name into directory.
+    """
+    def write(directory, name, persons=3, seed=0, file_name=None):
+        path = pathlib.Path(directory) / (file_name or f"{name}.xml")
+        path.write_text(stub_server.make_xjustiz_document(name, persons=persons, seed=seed), encoding="utf-8")
+        return path
+    return write
+
+
+@pytest.fixture
+def start_stub():
+    """
+    Start a stub server on a free port with the given serve() options and
+    return its base URL; all of them are shut down after the test.
+    """
+    servers = []
+
+    def start(**options):
+        server = stub_server.serve(port=0, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/rp_web"
+    try:
+        yield start
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+@pytest.fixture
+def stub_url(start_stub):
+    """
+    Base URL of a stub server serving three persons per document and one
+    result row per search.
+    """
+    return start_stub(persons=3, results=1)
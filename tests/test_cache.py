@@ -0,0 +1,63 @@
+"""
+Tests of the on-disk ResultCache.
+"""
+import os
+import time
+
+import handels_register
+
+
+def test_put_and_get(tmp_path):
+    cache = handels_register.ResultCache(str(tmp_path))
+    assert cache.get("html", "Firma", 2) is None
+    cache.put("html", "Firma", 2, "<html>Ergebnis</html>")
+    assert cache.get("html", "Firma", 2) == b"<html>Ergebnis</html>"
+    # Keyed on the keyword option and the kind as well
+    assert cache.get("html", "Firma", 1) is None
+    assert cache.get("xml", "Firma", 2) is None
+
+    source = tmp_path / "document.xml"
+    source.write_bytes(b"<document/>")
+    cache.put_file("xml", "Firma", 2, str(source))
+    assert cache.lookup("xml", "Firma", 2).read_bytes() == b"<document/>"
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = handels_register.ResultCache(str(tmp_path), ttl=3600)
+    cache.put("html", "Firma", 2, "alt")
+    path = cache.path("html", "Firma", 2)
+    stored = time.time() - 7200
+    os.utime(path, (stored, stored))
+    assert cache.get("html", "Firma", 2) is None
+
+    # ttl=0 keeps entries forever
+    assert handels_register.ResultCache(str(tmp_path), ttl=0).get("html", "Firma", 2) == b"alt"
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = handels_register.ResultCache(str(tmp_path), max_bytes=10_000)
+    for i in range(9):
+        cache.put("html", f"Firma {i}", 2, "x" * 1000)
+        path = cache.path("html", f"Firma {i}", 2)
+        os.utime(path, (1_000_000 + i, time.time()))
+    # Reading Firma 0 makes it the most recently used entry
+    assert cache.get("html", "Firma 0", 2) is not None
+    assert cache.total_bytes == 9000
+
+    cache.put("html", "Firma 9", 2, "x" * 2000)
+    remaining = {name for name in (f"Firma {i}" for i in range(10)) if cache.get("html", name, 2) is not None}
+    # Evicted down to 90% of max_bytes, oldest access first
+    assert remaining == {"Firma 0", "Firma 3", "Firma 4", "Firma 5", "Firma 6", "Firma 7", "Firma 8", "Firma 9"}
+    assert cache.total_bytes == sum(path.stat().st_size for path in tmp_path.iterdir()) == 9000
+
+
+def test_size_is_tracked_across_replacements_and_restarts(tmp_path):
+    cache = handels_register.ResultCache(str(tmp_path), max_bytes=1_000_000)
+    cache.put("html", "Firma", 2, "x" * 500)
+    cache.put("html", "Firma", 2, "x" * 300)
+    cache.put("list", "Firma", 2, "x" * 200)
+    assert cache.total_bytes == 500
+    (tmp_path / "notes.txt").write_text("not a cache entry")
+
+    assert handels_register.ResultCache(str(tmp_path), max_bytes=1_000_000).total_bytes == 500
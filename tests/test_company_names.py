@@ -0,0 +1,64 @@
+"""
+Tests of the lazy company name input.
+"""
+import concurrent.futures
+import io
+import itertools
+
+import openpyxl
+import pytest
+
+import handels_register
+
+NAMES = ["Firma  Eins GmbH", "firma eins gmbh", None, "   ", "Firma/Zwei KG", "FIRMAZWEI KG", 42, "Firma Drei AG"]
+EXPECTED = ["Firma Eins GmbH", "Firma/Zwei KG", "42", "Firma Drei AG"]
+
+
+def test_names_from_xlsx(tmp_path):
+    path = tmp_path / "names.xlsx"
+    workbook = openpyxl.Workbook()
+    workbook.active.append(["Firmenname", "Notiz"])
+    for name in NAMES:
+        workbook.active.append([name, "x"])
+    workbook.save(path)
+    assert list(handels_register.open_company_names(str(path))) == EXPECTED
+
+
+def test_names_from_csv(tmp_path):
+    path = tmp_path / "names.csv"
+    lines = ["Firmenname"] + ["" if name is None else str(name) for name in NAMES]
+    path.write_text("﻿" + "\n".join(lines) + "\n", encoding="utf-8")
+    assert list(handels_register.open_company_names(str(path))) == EXPECTED
+
+
+def test_names_from_stdin(monkeypatch):
+    lines = ["" if name is None else str(name) for name in NAMES]
+    monkeypatch.setattr("sys.stdin", io.StringIO("\n".join(lines) + "\n"))
+    assert list(handels_register.open_company_names("-")) == EXPECTED
+
+
+def test_names_from_dead_letter_file(tmp_path):
+    path = tmp_path / "result.dead.jsonl"
+    path.write_text('{"company": "Firma Eins GmbH"}\n\n{"company": "Firma Eins GmbH"}\n{"company": "Firma Zwei KG"}\n',
+                    encoding="utf-8")
+    assert list(handels_register.open_company_names(str(path))) == ["Firma Eins GmbH", "Firma Zwei KG"]
+
+
+def test_missing_file_raises_on_open(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        handels_register.open_company_names(str(tmp_path / "fehlt.csv"))
+
+
+def test_bounded_map_reads_the_input_lazily():
+    read = []
+
+    def names():
+        for i in itertools.count():
+            read.append(i)
+            yield i
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        results = handels_register.bounded_map(executor, lambda i: i * 2, names(), max_pending=4)
+        assert [next(results) for _ in range(10)] == [i * 2 for i in range(10)]
+    # Never more than max_pending items ahead of the consumer
+    assert len(read) <= 14
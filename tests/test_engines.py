@@ -0,0 +1,162 @@
+"""
+Tests of the download engines against stub_server.py.
+"""
+import asyncio
+import time
+
+import pytest
+
+import handels_register
+
+
+def fetch_args(tmp_path, stub_url="http://127.0.0.1:9/rp_web", *extra):
+    return handels_register.parse_args(None, [
+        "--base-url", stub_url, "--cache-dir", str(tmp_path / "cache"), "--timeout", "10", *extra])
+
+
+def test_threaded_engine_against_stub_server(tmp_path, monkeypatch, stub_url):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "files").mkdir()
+    args = fetch_args(tmp_path, stub_url)
+    pool = handels_register.SessionPool(args, size=1)
+
+    handels_register.process_company(args, "Firma Stub GmbH", "files/.xml", pool=pool)
+    documents = list((tmp_path / "files").glob("*.xml"))
+    assert len(documents) == 1
+    rows = handels_register.parse_xml_file(str(documents[0]))
+    assert [row.vorname for row in rows] == ["Vorname0", "Vorname1", "Vorname2"]
+    assert {row.bezeichnung for row in rows} == {"Firma Stub GmbH"}
+
+    session = pool.sessions.queue[0]
+    with pytest.raises(handels_register.NoResultError):
+        handels_register.process_company(args, "Unbekannt KG", "files/.xml", pool=pool)
+    # The warmed session survives an empty search and is used again
+    assert pool.sessions.queue[0] is session
+    handels_register.process_company(args, "Firma Zwei GmbH", "files/.xml", pool=pool)
+    assert pool.sessions.queue[0] is session
+
+
+def test_threaded_fetch_without_rows_leaves_the_output_alone(tmp_path, monkeypatch, capsys, stub_url):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "files").mkdir()
+    (tmp_path / "names.csv").write_text("Firma\nFirma Eins GmbH\nFirma Zwei GmbH\n", encoding="utf-8")
+    output = tmp_path / "result.sqlite"
+    args = fetch_args(tmp_path, stub_url, "-i", "names.csv", "-o", str(output), "--sessions", "2",
+                      "--export-xlsx", str(tmp_path / "result.xlsx"))
+
+    handels_register.run_fetch(args)
+    assert len(list((tmp_path / "files").glob("*.xml"))) == 2
+    # The documents are downloaded, but no rows reach the writer
+    assert not output.exists()
+    assert not (tmp_path / "result.xlsx").exists()
+    printed = capsys.readouterr().out
+    assert "Writer:" not in printed
+    assert "Ledger: 2 downloaded (finished)" in printed
+
+
+def test_session_pool_replaces_and_closes_failed_sessions(tmp_path, monkeypatch):
+    closed = []
+    monkeypatch.setattr(handels_register.HandelsRegister, "close", lambda self: closed.append(self))
+    pool = handels_register.SessionPool(fetch_args(tmp_path), size=1)
+
+    with pool.session() as first:
+        pass
+    for error in [handels_register.NoResultError("none"), handels_register.ThrottledError("429")]:
+        with pytest.raises(type(error)):
+            with pool.session() as h:
+                raise error
+        assert h is first
+    assert closed == []
+
+    with pytest.raises(handels_register.DownloadError):
+        with pool.session() as h:
+            raise handels_register.DownloadError("connection reset")
+    assert closed == [first]
+    with pool.session() as second:
+        assert second is not first
+
+
+def test_session_pool_replaces_idle_sessions(tmp_path, monkeypatch):
+    closed = []
+    monkeypatch.setattr(handels_register.HandelsRegister, "close", lambda self: closed.append(self))
+    pool = handels_register.SessionPool(fetch_args(tmp_path), size=1, max_idle=60)
+
+    with pool.session() as first:
+        pass
+    first.last_used -= 120
+    with pool.session() as second:
+        assert second is not first
+    assert closed == [first]
+
+
+def run_async(tmp_path, base_url, company_names, **options):
+    ledger = handels_register.JobLedger(str(tmp_path / "ledger.sqlite"))
+    downloader = handels_register.AsyncDownloader(
+        base_url=base_url, rate=0, max_sessions=2, backoff=0.01, timeout=10, ledger=ledger,
+        cache=handels_register.ResultCache(str(tmp_path / "cache")), **options)
+    try:
+        counts = asyncio.run(downloader.run(iter(company_names)))
+        return counts, dict(ledger.execute("SELECT company, status FROM jobs"))
+    finally:
+        ledger.close()
+
+
+def test_async_engine_against_stub_server(tmp_path, monkeypatch, stub_url):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "files").mkdir()
+    dead_letter = handels_register.DeadLetterFile(str(tmp_path / "dead.jsonl"))
+    counts, jobs = run_async(tmp_path, stub_url, ["Firma Eins GmbH", "Unbekannt KG", "Firma Zwei GmbH"],
+                             dead_letter=dead_letter)
+
+    assert counts == {"downloaded": 2, "searched": 0, "failed": 1}
+    assert jobs["Firma Eins GmbH"] == jobs["Firma Zwei GmbH"] == "downloaded"
+    assert dead_letter.count == 1
+    documents = sorted(path.name for path in (tmp_path / "files").glob("*.xml"))
+    assert documents == ["Firma Eins GmbH.xml", "Firma Zwei GmbH.xml"]
+    for path in (tmp_path / "files").glob("*.xml"):
+        assert len(handels_register.parse_xml_file(str(path))) == 3
+
+
+def test_async_engine_retries_throttled_requests(tmp_path, monkeypatch, start_stub):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "files").mkdir()
+    base_url = start_stub(persons=2, results=1, fail_rate=0.3)
+    names = [f"Firma {i} GmbH" for i in range(6)]
+    counts, _ = run_async(tmp_path, base_url, names, max_retries=10)
+    assert counts["downloaded"] == 6
+    assert len(list((tmp_path / "files").glob("*.xml"))) == 6
+
+
+def test_async_engine_does_not_retry_exhausted_requests(tmp_path, monkeypatch, start_stub):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "files").mkdir()
+    base_url = start_stub(persons=2, results=1, fail_rate=1.0)
+    sessions = []
+    new_session = handels_register.AsyncDownloader.new_session
+
+    def counting_new_session(self):
+        sessions.append(new_session(self))
+        return sessions[-1]
+
+    monkeypatch.setattr(handels_register.AsyncDownloader, "new_session", counting_new_session)
+    dead_letter = handels_register.DeadLetterFile(str(tmp_path / "dead.jsonl"))
+    start = time.monotonic()
+    # The throttled policy would wait 30 s before retrying the company
+    counts, jobs = run_async(tmp_path, base_url, ["Firma Eins GmbH", "Firma Zwei GmbH"], max_retries=1,
+                             dead_letter=dead_letter)
+    assert time.monotonic() - start < 5
+    assert counts == {"downloaded": 0, "searched": 0, "failed": 2}
+    assert dead_letter.count == 2
+    # Throttling is no reason to drop a session
+    assert len(sessions) == 2
+
+
+def test_token_bucket_limits_the_request_rate():
+    async def acquire(bucket, times):
+        start = time.monotonic()
+        for _ in range(times):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(acquire(handels_register.TokenBucket(rate=50), 6)) >= 0.09
+    assert asyncio.run(acquire(handels_register.TokenBucket(rate=0), 100)) < 0.05
@@ -0,0 +1,134 @@
+"""
+Tests of the per-company failure handling: error classes, retries, the
+dead letter file and document validation.
+"""
+import json
+import socket
+
+import pytest
+from lxml import etree
+
+import handels_register
+import stub_server
+
+
+def test_parse_retry_policy():
+    policy = handels_register.parse_retry_policy(["throttled=8:60", "network=1"])
+    assert policy["throttled"] == (8, 60.0)
+    assert policy["network"] == (1, handels_register.DEFAULT_RETRY_POLICY["network"][1])
+    assert policy["no_result"] == handels_register.DEFAULT_RETRY_POLICY["no_result"]
+
+    for value in ["unknown=1", "network", "network=x", "network=-1"]:
+        with pytest.raises(ValueError):
+            handels_register.parse_retry_policy([value])
+
+
+def test_retry_delay():
+    policy = {"network": (2, 5.0)}
+    assert [handels_register.retry_delay(policy, "network", attempt) for attempt in range(3)] == [5.0, 10.0, None]
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def test_classify_error():
+    classify = handels_register.classify_error
+    assert classify(handels_register.DownloadError("failed")) == "network"
+    assert classify(handels_register.ThrottledError("429")) == "throttled"
+    assert classify(handels_register.NoResultError("none")) == "no_result"
+    assert classify(handels_register.InvalidDocumentError("html")) == "invalid_xml"
+    assert classify(HTTPStatusError(429)) == "throttled"
+    assert classify(HTTPStatusError(503)) == "throttled"
+    assert classify(TimeoutError("timed out")) == "network"
+    assert classify(ConnectionResetError()) == "network"
+    with pytest.raises(etree.XMLSyntaxError) as error:
+        etree.fromstring(b"<unclosed")
+    assert classify(error.value) == "invalid_xml"
+    assert classify(IndexError("list index out of range")) == "error"
+
+
+def test_validate_document():
+    validate = handels_register.validate_document
+    document = stub_server.make_xjustiz_document("Firma").encode("utf-8")
+    validate(document, "application/xml")
+    validate(b"\xef\xbb\xbf" + document)
+
+    for content, content_type in [
+        (b"", None),
+        (b"<html><body>Fehler</body></html>", None),
+        (b"<!DOCTYPE html><html></html>", None),
+        (b"Service Unavailable", None),
+        (document, "text/html; charset=utf-8"),
+    ]:
+        with pytest.raises(handels_register.InvalidDocumentError):
+            validate(content, content_type)
+    with pytest.raises(handels_register.InvalidDocumentError):
+        validate(document, max_bytes=100)
+
+
+def test_dead_letter_file_is_replaced_per_run(tmp_path):
+    path = tmp_path / "result.dead.jsonl"
+    dead_letter = handels_register.DeadLetterFile(str(path))
+    dead_letter.add("Firma A", "network", TimeoutError("timed out"), 4)
+    dead_letter.add("Firma B", "no_result", handels_register.NoResultError("none"), 1)
+    # Nothing replaces the file being read until the run is over
+    assert not path.exists()
+    dead_letter.close()
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [(r["company"], r["error_class"], r["attempts"]) for r in records] == [("Firma A", "network", 4), ("Firma B", "no_result", 1)]
+    assert records[0]["error"] == "TimeoutError: timed out"
+
+    # A re-run from the file keeps only what failed again
+    assert list(handels_register.open_company_names(str(path))) == ["Firma A", "Firma B"]
+    dead_letter = handels_register.DeadLetterFile(str(path))
+    dead_letter.add("Firma B", "no_result", handels_register.NoResultError("none"), 1)
+    dead_letter.close()
+    assert list(handels_register.open_company_names(str(path))) == ["Firma B"]
+
+    # and is removed once everything succeeded
+    handels_register.DeadLetterFile(str(path)).close()
+    assert not path.exists()
+
+
+def test_process_company_isolated_retries_per_class(tmp_path, monkeypatch):
+    attempts = []
+    errors = iter([TimeoutError("timed out"), TimeoutError("timed out"), None, handels_register.NoResultError("none")])
+
+    def process_company(args, company_name, *rest):
+        attempts.append(company_name)
+        error = next(errors)
+        if error is not None:
+            raise error
+
+    monkeypatch.setattr(handels_register, "process_company", process_company)
+    monkeypatch.setattr(handels_register.time, "sleep", lambda seconds: None)
+    policy = handels_register.parse_retry_policy(["network=2:0"])
+    dead_letter = handels_register.DeadLetterFile(str(tmp_path / "dead.jsonl"))
+
+    assert handels_register.process_company_isolated(None, "Firma A", None, retry_policy=policy, dead_letter=dead_letter)
+    assert attempts == ["Firma A"] * 3
+    # no_result is not retried by default
+    assert not handels_register.process_company_isolated(None, "Firma B", None, retry_policy=policy, dead_letter=dead_letter)
+    assert attempts == ["Firma A"] * 3 + ["Firma B"]
+    assert dead_letter.count == 1
+
+
+def test_stalled_server_fails_as_network_error(tmp_path):
+    # Accepts connections and never answers
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(4)
+    try:
+        args = handels_register.parse_args(None, [
+            "--base-url", f"http://127.0.0.1:{server.getsockname()[1]}/rp_web",
+            "--cache-dir", str(tmp_path / "cache"), "--timeout", "0.2"])
+        h = handels_register.HandelsRegister(args)
+        with pytest.raises(Exception) as error:
+            h.search_company("Firma A")
+        assert handels_register.classify_error(error.value) == "network"
+        h.close()
+    finally:
+        server.close()
@@ -0,0 +1,53 @@
+"""
+Tests of the JobLedger and of --resume.
+"""
+import handels_register
+
+
+def test_ledger_records_stages_attempts_and_errors(tmp_path):
+    path = str(tmp_path / "ledger.sqlite")
+    ledger = handels_register.JobLedger(path)
+    ledger.start("Firma A")
+    ledger.mark("Firma A", "searched")
+    ledger.finish("Firma A", "downloaded")
+    ledger.start("Firma B")
+    ledger.fail("Firma B", "timed out")
+    ledger.start("Firma C")
+    ledger.close()
+
+    # The ledger survives the process, like after a crash
+    ledger = handels_register.JobLedger(path)
+    assert ledger.finished_companies() == {"Firma A"}
+    assert ledger.failed_companies() == {"Firma B"}
+    assert sorted(ledger.summary()) == ["1 downloaded (finished)", "1 pending", "1 pending (failed)"]
+
+    ledger.start("Firma B")
+    ledger.finish("Firma B", "downloaded")
+    assert ledger.execute("SELECT attempts, last_error FROM jobs WHERE company = ?", ("Firma B",)) == [(2, None)]
+    assert ledger.failed_companies() == set()
+    ledger.close()
+
+
+def test_resume_skips_finished_companies(tmp_path, monkeypatch, capsys, stub_url):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "files").mkdir()
+    (tmp_path / "names.csv").write_text("Firma\nFirma Eins GmbH\nUnbekannt KG\nFirma Zwei GmbH\n", encoding="utf-8")
+    argv = ["--input", "names.csv", "--output", "result.xlsx", "--base-url", stub_url, "--sessions", "1",
+            "--cache-dir", "cache", "--retry", "no_result=0", "--force"]
+
+    handels_register.run_fetch(handels_register.parse_args(None, argv))
+    ledger = handels_register.JobLedger("result.ledger.sqlite")
+    assert ledger.finished_companies() == {"Firma Eins GmbH", "Firma Zwei GmbH"}
+    assert ledger.failed_companies() == {"Unbekannt KG"}
+    ledger.close()
+    for path in (tmp_path / "files").glob("*.xml"):
+        path.unlink()
+    capsys.readouterr()
+
+    handels_register.run_fetch(handels_register.parse_args(None, argv + ["--resume"]))
+    assert "Resumed: skipped 2 finished companies, retried 1 failed" in capsys.readouterr().out
+    # Nothing was downloaded again
+    assert not list((tmp_path / "files").glob("*.xml"))
+    ledger = handels_register.JobLedger("result.ledger.sqlite")
+    assert ledger.execute("SELECT attempts FROM jobs WHERE company = ?", ("Unbekannt KG",)) == [(2,)]
+    ledger.close()
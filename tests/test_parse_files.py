@@ -0,0 +1,143 @@
+"""
+Tests of the offline parsing of a directory of downloaded documents.
+"""
+import csv
+import sqlite3
+
+import pytest
+
+import handels_register
+
+
+def test_parse_xml_file_tags_rows_with_file_name(tmp_path, write_document):
+    path = write_document(tmp_path, "Firma Eins GmbH", persons=3, file_name="eins.xml")
+    rows = handels_register.parse_xml_file(str(path))
+    assert [row.file for row in rows] == ["eins.xml"] * 3
+    assert [row.vorname for row in rows] == ["Vorname0", "Vorname1", "Vorname2"]
+
+
+def test_parse_xml_files_to_csv(tmp_path, write_document):
+    files = tmp_path / "files"
+    files.mkdir()
+    write_document(files, "Firma Eins GmbH", persons=3, file_name="eins.xml")
+    write_document(files, "Firma Zwei GmbH", persons=2, file_name="zwei.xml")
+    (files / "leer.xml").write_bytes(b"")
+    output = tmp_path / "rows.csv"
+
+    assert handels_register.parse_xml_files(str(files), str(output), workers=2, chunksize=1) == 5
+    with open(output, newline="", encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    assert list(rows[0]) == handels_register.XML_ROW_FIELDS
+    assert sorted((row["file"], row["vorname"]) for row in rows) == [
+        ("eins.xml", "Vorname0"), ("eins.xml", "Vorname1"), ("eins.xml", "Vorname2"),
+        ("zwei.xml", "Vorname0"), ("zwei.xml", "Vorname1"),
+    ]
+
+
+def test_parse_xml_files_without_files(tmp_path):
+    assert handels_register.parse_xml_files(str(tmp_path), str(tmp_path / "rows.csv")) == 0
+
+
+def record(**fields):
+    return handels_register.PersonRecord(**fields)
+
+
+def test_diff_document_rows():
+    company = {"bezeichnung": "Firma", "strasse": "Hauptstraße"}
+    anna = record(vorname="Anna", nachname="A", geburtsdatum="1970-01-01", rolle="Prokurist(in)", **company)
+    bernd = record(vorname="Bernd", nachname="B", geburtsdatum="1980-01-01", rolle="Geschäftsführer(in)", **company)
+    carla = record(vorname="Carla", nachname="C", geburtsdatum="1990-01-01", rolle="Prokurist(in)", **company)
+
+    assert handels_register.diff_document_rows([anna, bernd], [anna, bernd]) == []
+
+    new_rows = [
+        anna._replace(rolle="Geschäftsführer(in)", strasse="Nebenstraße"),
+        carla._replace(strasse="Nebenstraße"),
+    ]
+    changes = handels_register.diff_document_rows([anna, bernd], new_rows)
+    assert {"change": "company", "field": "strasse", "old": "Hauptstraße", "new": "Nebenstraße"} in changes
+    assert {"change": "person", "person": {"vorname": "Anna", "nachname": "A", "geburtsdatum": "1970-01-01"},
+            "field": "rolle", "old": "Prokurist(in)", "new": "Geschäftsführer(in)"} in changes
+    assert {"change": "person_added", "person": {"vorname": "Carla", "nachname": "C", "geburtsdatum": "1990-01-01"},
+            "rolle": "Prokurist(in)"} in changes
+    assert {"change": "person_removed", "person": {"vorname": "Bernd", "nachname": "B", "geburtsdatum": "1980-01-01"},
+            "rolle": "Geschäftsführer(in)"} in changes
+    assert len(changes) == 4
+
+
+def test_incremental_parse_deletes_removed_and_renamed(tmp_path, write_document):
+    files = tmp_path / "files"
+    files.mkdir()
+    write_document(files, "Firma Eins GmbH", persons=3, file_name="eins.xml")
+    write_document(files, "Firma Zwei GmbH", persons=2, file_name="zwei.xml")
+    output = tmp_path / "rows.sqlite"
+    index = tmp_path / "documents.sqlite"
+    changes = tmp_path / "changes.jsonl"
+
+    def parse():
+        handels_register.parse_xml_files(str(files), str(output), workers=1, index_path=str(index), changes_path=str(changes))
+        with sqlite3.connect(output) as connection:
+            return sorted(connection.execute("SELECT bezeichnung, vorname FROM xml_rows").fetchall())
+
+    assert len(parse()) == 5
+
+    # One person fewer, and the other company renamed
+    write_document(files, "Firma Eins GmbH", persons=2, file_name="eins.xml")
+    write_document(files, "Firma Drei GmbH", persons=2, file_name="zwei.xml")
+    assert parse() == [
+        ("Firma Drei GmbH", "Vorname0"), ("Firma Drei GmbH", "Vorname1"),
+        ("Firma Eins GmbH", "Vorname0"), ("Firma Eins GmbH", "Vorname1"),
+    ]
+    assert len(changes.read_text(encoding="utf-8").splitlines()) == 4
+
+    # Unchanged files are skipped and leave the rows alone
+    assert len(parse()) == 4
+    assert len(changes.read_text(encoding="utf-8").splitlines()) == 4
+
+
+def test_incremental_parse_keeps_rows_of_a_broken_document(tmp_path, write_document):
+    files = tmp_path / "files"
+    files.mkdir()
+    path = write_document(files, "Firma Eins GmbH", persons=3, file_name="eins.xml")
+    output = tmp_path / "rows.sqlite"
+    index = tmp_path / "documents.sqlite"
+    changes = tmp_path / "changes.jsonl"
+
+    def parse():
+        handels_register.parse_xml_files(str(files), str(output), workers=1, index_path=str(index), changes_path=str(changes))
+        with sqlite3.connect(output) as connection:
+            return len(connection.execute("SELECT * FROM xml_rows").fetchall())
+
+    assert parse() == 3
+    assert handels_register.parse_xml_file(str(path)) is not None
+
+    # A document that cannot be parsed is not one without persons
+    data = path.read_bytes()
+    path.write_bytes(b"")
+    assert handels_register.parse_xml_file(str(path)) is None
+    assert parse() == 3
+    assert len(changes.read_text(encoding="utf-8").splitlines()) == 1
+
+    # Its index entry was not replaced, so the repaired file is unchanged
+    path.write_bytes(data)
+    assert parse() == 3
+    assert len(changes.read_text(encoding="utf-8").splitlines()) == 1
+
+
+def test_incremental_parse_refuses_parquet(tmp_path):
+    with pytest.raises(ValueError):
+        handels_register.parse_xml_files(str(tmp_path), str(tmp_path / "rows.parquet"), index_path=str(tmp_path / "index.sqlite"))
+
+
+def test_document_index_tolerates_field_changes(tmp_path):
+    index = handels_register.DocumentIndex(str(tmp_path / "documents.sqlite"))
+    index.put([("a.xml", "abc", [record(vorname="Anna", nachname="A")])])
+    # A field that no longer exists is dropped, a new one comes back as None
+    index.connection.execute(
+        "UPDATE documents SET rows = ? WHERE file = ?",
+        ('[{"vorname": "Anna", "nachname": "A", "veraltet": "x"}]', "a.xml"))
+    sha256, rows = index.get("a.xml")
+    assert sha256 == "abc"
+    assert rows == [record(vorname="Anna", nachname="A")]
+    assert index.get("b.xml") is None
+    index.close()
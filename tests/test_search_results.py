@@ -0,0 +1,91 @@
+"""
+Tests of the search result parsing and paging on stub_server.py pages.
+"""
+import handels_register
+import stub_server
+
+
+def test_parse_search_results():
+    html = stub_server.make_result_page("Firma & Co. KG", rows=3, view_state="v1", cid=7)
+    for content in (html, html.encode("utf-8")):
+        page = handels_register.parse_search_results(content)
+        assert page["view_state"] == "v1"
+        assert page["action"].endswith("sucheErgebnisse.xhtml?cid=7")
+        assert [row["data_ri"] for row in page["rows"]] == ["0", "1", "2"]
+        assert page["rows"][0]["anchor_ids"][-1] == "ergebnissForm:selectedSuchErgebnisFormTable:0:j_idt219:6:fade_"
+
+    record = handels_register.HandelsRegister.parse_result_cells(page["rows"][1]["cells"])
+    assert record == handels_register.CompanyRecord(
+        court="Berlin Amtsgericht Charlottenburg HRB 10001", name="Firma & Co. KG", state="Berlin",
+        status="aktuell", documents="AD\nSI", history=[6])
+
+
+def test_parse_result_cells_history():
+    cells = ["", "Berlin HRB 1", "Firma", "Berlin", "aktuell", "AD SI", "", "", "Umzug", "2020-01-01", "Umfirmierung", "2021-02-03"]
+    record = handels_register.HandelsRegister.parse_result_cells(cells)
+    assert record.history == [6, ("Umzug", "2020-01-01"), ("Umfirmierung", "2021-02-03")]
+
+
+def test_pages_without_results():
+    assert handels_register.parse_search_results("<html><body>Wartung</body></html>")["rows"] is None
+    assert handels_register.parse_search_results("")["rows"] is None
+    empty = handels_register.parse_search_results(stub_server.make_result_page("Unbekannt", rows=0))
+    assert empty["rows"] == []
+    assert handels_register.build_document_request(empty) is None
+
+
+def test_pagination_request_and_partial_response():
+    page = handels_register.parse_search_results(stub_server.make_result_page("Firma A", rows=10, view_state="v1", cid=7))
+    url, data = handels_register.build_pagination_request(page, first=10, rows=10, base_url="http://stub/rp_web")
+    assert url == "http://stub/rp_web/xhtml/research/sucheErgebnisse.xhtml?cid=7"
+    table = handels_register.RESULT_TABLE_ID
+    assert (data[f"{table}_first"], data[f"{table}_rows"], data["javax.faces.ViewState"]) == ("10", "10", "v1")
+
+    partial = stub_server.PARTIAL_RESPONSE.format(rows=stub_server.make_result_rows("Firma A", 10, 5), view_state="v2")
+    next_page = handels_register.parse_partial_response(partial.encode("utf-8"), page)
+    assert next_page["view_state"] == "v2"
+    assert next_page["action"] == page["action"]
+    assert [row["data_ri"] for row in next_page["rows"]] == [str(i) for i in range(10, 15)]
+
+    # The document of a row on a later page is requested with that page's ViewState
+    url, data = handels_register.build_document_request(next_page, "http://stub/rp_web", row_index=2)
+    assert next_page["rows"][2]["anchor_ids"][-1] in data
+    assert data["javax.faces.ViewState"] == "v2"
+
+
+def test_document_file_paths_are_unique_per_row():
+    page = handels_register.parse_search_results(stub_server.make_result_page("Firma A", rows=2))
+    used = set()
+    paths = [handels_register.document_file_path("Firma A", row, used) for row in page["rows"] * 2]
+    assert len(set(paths)) == 4
+    assert handels_register.document_file_path("Firma A") == "files/Firma A.xml"
+
+
+def all_result_documents(directory):
+    names = {}
+    for path in directory.glob("*.xml"):
+        names[path.name] = handels_register.parse_xml_file(str(path))[0].bezeichnung
+    return names
+
+
+def test_all_results_with_both_engines(tmp_path, monkeypatch, start_stub):
+    import asyncio
+
+    monkeypatch.chdir(tmp_path)
+    base_url = start_stub(persons=1, results=23)
+    expected = {"Firma A"} | {f"Firma A ({row})" for row in range(1, 23)}
+
+    (tmp_path / "files").mkdir()
+    args = handels_register.parse_args(None, [
+        "--base-url", base_url, "--cache-dir", "cache-threads", "--all-results", "--document-workers", "3"])
+    handels_register.process_company(args, "Firma A", "files/.xml", pool=handels_register.SessionPool(args, size=1))
+    threaded = all_result_documents(tmp_path / "files")
+    assert set(threaded.values()) == expected
+
+    (tmp_path / "files").rename(tmp_path / "files-threads")
+    (tmp_path / "files").mkdir()
+    downloader = handels_register.AsyncDownloader(
+        base_url=base_url, rate=0, all_results=True, document_workers=3,
+        cache=handels_register.ResultCache(str(tmp_path / "cache-async")))
+    assert asyncio.run(downloader.run(["Firma A"]))["downloaded"] == 1
+    assert all_result_documents(tmp_path / "files") == threaded
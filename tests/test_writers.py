@@ -0,0 +1,241 @@
+"""
+Tests of the result writers behind --output.
+"""
+import csv
+import sqlite3
+import threading
+import time
+
+import openpyxl
+
+import handels_register
+
+
+def company(name="Firma Eins GmbH"):
+    return {"name": name, "court": "Amtsgericht Berlin", "state": "Berlin", "status": "aktuell", "documents": "AD SI"}
+
+
+def person(vorname, nachname, ort="Berlin", base=None):
+    return {**(base or company()), "bezeichnung": "Firma Eins GmbH", "vorname": vorname, "nachname": nachname, "ort": ort}
+
+
+def sheet_rows(path, title):
+    return list(openpyxl.load_workbook(path)[title].iter_rows(min_row=2, values_only=True))
+
+
+def test_excel_writer_updates_goal_rows_in_place(tmp_path):
+    path = tmp_path / "result.xlsx"
+    handels_register.save_to_excel([company()], [person("Anna", "A"), person("Anna", "B")], str(path))
+
+    # Reopened: the index of the existing rows is built from the file
+    writer = handels_register.ExcelResultWriter(str(path), flush_every=0)
+    writer.add([company()], [person("Anna", "A", "Potsdam"), person("Carl", "C")])
+    writer.close()
+
+    goal = sheet_rows(path, "Goal output")
+    columns = handels_register.GOAL_OUTPUT_KEYS
+    assert [(row[columns.index("vorname")], row[columns.index("nachname")], row[columns.index("ort")]) for row in goal] == [
+        ("Anna", "A", "Potsdam"), ("Anna", "B", "Berlin"), ("Carl", "C", "Berlin"),
+    ]
+    # "Current output" gets the search results of every run appended
+    assert len(sheet_rows(path, "Current output")) == 2
+
+
+def test_excel_writer_saves_in_batches(tmp_path):
+    path = tmp_path / "result.xlsx"
+    writer = handels_register.ExcelResultWriter(str(path), flush_every=2)
+    writer.add([company("A")], [person("Anna", "A", base=company("A"))], "A")
+    assert not path.exists()
+    writer.add([company("B")], [person("Bernd", "B", base=company("B"))], "B")
+    assert len(sheet_rows(path, "Goal output")) == 2
+    writer.add([company("C")], [person("Carl", "C", base=company("C"))], "C")
+    writer.close()
+    assert len(sheet_rows(path, "Goal output")) == 3
+
+
+class RecordingWriter(handels_register.BufferedResultWriter):
+    """
+    Keeps the saved batches in memory, with the thread that saved them.
+    """
+    def __init__(self, flush_every=10, ledger=None):
+        super().__init__("memory", flush_every, ledger)
+        self.saved = []
+        self.threads = set()
+        self.saving = 0
+        self.overlapping = False
+
+    def save(self, current_rows, goal_rows):
+        self.saving += 1
+        self.overlapping |= self.saving > 1
+        self.threads.add(threading.get_ident())
+        time.sleep(0.001)
+        self.saved.append((current_rows, goal_rows))
+        self.saving -= 1
+
+
+class FailingWriter(RecordingWriter):
+    """
+    RecordingWriter whose next `failures` saves raise.
+    """
+    def __init__(self, failures, **options):
+        super().__init__(**options)
+        self.failures = failures
+
+    def save(self, current_rows, goal_rows):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        super().save(current_rows, goal_rows)
+
+
+def ledger_jobs(ledger):
+    return {company: (finished, error) for company, finished, error in ledger.execute("SELECT company, finished, last_error FROM jobs")}
+
+
+def test_failed_save_keeps_the_batch_for_the_next_flush(tmp_path):
+    ledger = handels_register.JobLedger(str(tmp_path / "jobs.db"))
+    writer = FailingWriter(1, flush_every=1, ledger=ledger)
+    ledger.start("A")
+    writer.add([company("A")], [person("Anna", "A", base=company("A"))], "A")
+    assert writer.saved == []
+    assert ledger_jobs(ledger) == {"A": (0, None)}
+
+    ledger.start("B")
+    writer.add([company("B")], [person("Bernd", "B", base=company("B"))], "B")
+    writer.close()
+    assert [[row[0] for row in current_rows] for current_rows, goal_rows in writer.saved if current_rows] == [["A", "B"]]
+    assert ledger_jobs(ledger) == {"A": (1, None), "B": (1, None)}
+
+
+def test_unsaved_companies_are_failed_on_close(tmp_path):
+    ledger = handels_register.JobLedger(str(tmp_path / "jobs.db"))
+    writer = FailingWriter(2, flush_every=1, ledger=ledger)
+    ledger.start("A")
+    writer.add([company("A")], [person("Anna", "A", base=company("A"))], "A")
+    writer.close()
+    assert ledger_jobs(ledger) == {"A": (0, "Results not saved: disk full")}
+    assert ledger.failed_companies() == {"A"}
+
+
+def test_excel_writer_saves_a_failed_batch_once(tmp_path, monkeypatch):
+    path = tmp_path / "result.xlsx"
+    writer = handels_register.ExcelResultWriter(str(path), flush_every=1)
+    save = writer.workbook.save
+    failures = [OSError("locked")]
+
+    def flaky_save(filepath):
+        if failures:
+            raise failures.pop()
+        save(filepath)
+
+    monkeypatch.setattr(writer.workbook, "save", flaky_save)
+    writer.add([company("A")], [person("Anna", "A", base=company("A"))], "A")
+    writer.add([company("B")], [person("Bernd", "B", base=company("B"))], "B")
+    writer.close()
+    assert [row[0] for row in sheet_rows(path, "Current output")] == ["A", "B"]
+    assert len(sheet_rows(path, "Goal output")) == 2
+
+
+def test_output_queue_has_a_single_writer_thread():
+    writer = RecordingWriter()
+    producers = []
+    with handels_register.OutputQueue(writer, maxsize=5, batch_size=4) as output:
+        def produce(worker):
+            for i in range(25):
+                name = f"Firma {worker}-{i}"
+                output.add([company(name)], [person("Anna", "A", base=company(name))], name)
+        producers = [threading.Thread(target=produce, args=(worker,)) for worker in range(8)]
+        for thread in producers:
+            thread.start()
+        for thread in producers:
+            thread.join()
+
+    assert output.rows_written == 200
+    goal_rows = [row for _, goal in writer.saved for row in goal]
+    assert len(goal_rows) == len({row[0] for row in goal_rows}) == 200
+    # Only the writer thread saves while the workers run (close() flushes the rest)
+    assert not writer.overlapping
+    assert writer.threads.isdisjoint(thread.ident for thread in producers)
+    assert len(writer.threads - {threading.get_ident()}) == 1
+
+
+def test_output_queue_survives_a_failing_add():
+    class FailingWriter(RecordingWriter):
+        def add(self, companies, merged_data, company_name=None):
+            if company_name == "kaputt":
+                raise ValueError("broken row")
+            super().add(companies, merged_data, company_name)
+
+    writer = FailingWriter(flush_every=0)
+    with handels_register.OutputQueue(writer) as output:
+        for name in ["A", "kaputt", "B"]:
+            output.add([company(name)], [person("Anna", "A", base=company(name))], name)
+    assert output.rows_written == 2
+    assert [row[0] for _, goal in writer.saved for row in goal] == ["A", "B"]
+
+
+def test_lazy_result_writer_opens_on_first_rows():
+    opened = []
+
+    def open_writer():
+        opened.append(RecordingWriter(flush_every=0))
+        return opened[-1]
+
+    with handels_register.LazyResultWriter(open_writer) as writer:
+        assert not writer.opened
+    assert opened == []
+
+    with handels_register.LazyResultWriter(open_writer) as writer:
+        writer.add([{"name": "A"}], [], "A")
+        writer.add([{"name": "B"}], [], "B")
+    assert len(opened) == 1
+    assert [row[0] for row in opened[0].saved[0][0]] == ["A", "B"]
+
+
+def test_sql_row_sink_upserts_on_key_and_appends_without(tmp_path):
+    target = str(tmp_path / "rows.sqlite")
+    fields = ["name", "vorname", "ort"]
+    with handels_register.SqlRowSink(target, fields, "keyed", ("name", "vorname")) as sink:
+        sink.write([("Firma", "Anna", "Berlin"), ("Firma", "Bernd", "Berlin"), ("Firma", None, "Köln")])
+    with handels_register.SqlRowSink(target, fields, "keyed", ("name", "vorname")) as sink:
+        sink.write([("Firma", "Anna", "Potsdam"), ("Firma", None, "Bonn")])
+        sink.delete([("Firma", "Bernd")])
+    with handels_register.SqlRowSink(target, fields, "log", ()) as sink:
+        sink.write([("Firma", "Anna", "Berlin")] * 2)
+
+    with sqlite3.connect(target) as connection:
+        # A missing key value is stored as "" and upserted like any other
+        assert connection.execute("SELECT name, vorname, ort FROM keyed ORDER BY rowid").fetchall() == [
+            ("Firma", "Anna", "Potsdam"), ("Firma", "", "Bonn")]
+        assert connection.execute("SELECT COUNT(*) FROM log").fetchone() == (2,)
+
+
+def test_database_result_writer_and_export(tmp_path):
+    target = str(tmp_path / "result.sqlite")
+    for ort in ("Berlin", "Potsdam"):
+        with handels_register.open_result_writer(target, flush_every=0) as writer:
+            writer.add([company()], [person("Anna", "A", ort), person("Anna", "B")])
+
+    with sqlite3.connect(target) as connection:
+        assert connection.execute("SELECT vorname, nachname, ort FROM goal_output ORDER BY rowid").fetchall() == [
+            ("Anna", "A", "Potsdam"), ("Anna", "B", "Berlin")]
+        assert connection.execute("SELECT COUNT(*) FROM current_output").fetchone() == (2,)
+
+    xlsx = tmp_path / "export.xlsx"
+    assert handels_register.export_xlsx(target, str(xlsx)) == 4
+    assert len(sheet_rows(xlsx, "Goal output")) == 2
+    assert len(sheet_rows(xlsx, "Current output")) == 2
+
+
+def test_csv_result_writer_appends(tmp_path):
+    target = tmp_path / "result.csv"
+    for _ in range(2):
+        with handels_register.open_result_writer(str(target), flush_every=0) as writer:
+            writer.add([company()], [person("Anna", "A")])
+
+    with open(target, newline="", encoding="utf-8") as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == handels_register.GOAL_OUTPUT_KEYS
+    assert len(rows) == 3
+    with open(tmp_path / "result.current.csv", newline="", encoding="utf-8") as file:
+        assert len(list(csv.reader(file))) == 3
@@ -0,0 +1,93 @@
+"""
+Tests of the XJustiz extraction of XMLParser on stub_server.py documents.
+"""
+import pytest
+from lxml import etree
+
+import handels_register
+
+NAMESPACES = handels_register.XJUSTIZ_NAMESPACES
+
+
+def baseline_rows(path):
+    """
+    The rows of the former XMLParser.retrieve_xml_data, which searched the
+    whole tree once per person and took the gender of the first person for
+    every row.
+    """
+    root = etree.parse(str(path), etree.XMLParser(recover=True)).getroot()
+
+    def text(element_path):
+        element = root.find(element_path, namespaces=NAMESPACES)
+        return element.text.strip() if element is not None and element.text else None
+
+    def comment(element_path):
+        element = root.xpath(element_path, namespaces=NAMESPACES)
+        if element:
+            for node in root.xpath('//comment()'):
+                if node.getparent() == element[0]:
+                    return node.text.strip()
+        return None
+
+    rows = []
+    names = root.findall('.//tns:vollerName', namespaces=NAMESPACES)
+    for i, name in enumerate(names):
+        rows.append({
+            "bezeichnung": text('.//tns:bezeichnung.aktuell'),
+            "rechtsform": comment('.//tns:angabenZurRechtsform/tns:rechtsform'),
+            "strasse": text('.//tns:anschrift/tns:strasse'),
+            "hausnummer": text('.//tns:anschrift/tns:hausnummer'),
+            "postleitzahl": text('.//tns:anschrift/tns:postleitzahl'),
+            "ort": text('.//tns:anschrift/tns:ort'),
+            "vorname": name.find('tns:vorname', namespaces=NAMESPACES).text,
+            "nachname": name.find('tns:nachname', namespaces=NAMESPACES).text,
+            "geschlecht": comment('.//tns:geschlecht'),
+            "geburtsdatum": root.findall('.//tns:geburtsdatum', namespaces=NAMESPACES)[i].text,
+            "gegenstand": text('.//tns:basisdatenRegister/tns:gegenstand'),
+            "vertretungsbefugnis": text('.//tns:auswahl_vertretungsbefugnis/tns:vertretungsbefugnisFreitext'),
+        })
+    return rows
+
+
+def person_genders(path):
+    """
+    The gender comment inside the <tns:beteiligung> of every person.
+    """
+    root = etree.parse(str(path)).getroot()
+    return [
+        scope.xpath("string(.//tns:geschlecht/comment())", namespaces=NAMESPACES).strip()
+        for scope in root.iterfind(".//tns:beteiligung", NAMESPACES)
+        if scope.find(".//tns:vollerName", NAMESPACES) is not None
+    ]
+
+
+@pytest.mark.parametrize("persons", [1, 3, 25])
+def test_extraction_matches_baseline(tmp_path, write_document, persons):
+    path = write_document(tmp_path, "Firma Eins GmbH", persons=persons, seed=persons)
+    xml_parser = handels_register.XMLParser(str(path))
+    xml_parser.parse_xml()
+    rows = xml_parser.retrieve_xml_data(NAMESPACES)
+    expected = baseline_rows(path)
+
+    assert len(rows) == len(expected) == persons
+    for row, old in zip(rows, expected):
+        # Same fields as before, except that every person keeps their own gender
+        assert {field: value for field, value in row._asdict().items() if field in old and field != "geschlecht"} == \
+            {field: value for field, value in old.items() if field != "geschlecht"}
+    assert [row.geschlecht for row in rows] == person_genders(path)
+    assert rows[0].geschlecht == expected[0]["geschlecht"]
+
+
+@pytest.mark.parametrize("truncate", [False, True])
+def test_streaming_matches_tree_parse(tmp_path, write_document, truncate):
+    path = write_document(tmp_path, "Firma Zwei AG", persons=12, seed=3)
+    if truncate:
+        # Recovery mode keeps the persons before the cut in both parsers
+        content = path.read_text(encoding="utf-8")
+        path.write_text(content[:len(content) * 2 // 3], encoding="utf-8")
+    xml_parser = handels_register.XMLParser(str(path))
+    xml_parser.parse_xml()
+    rows = xml_parser.retrieve_xml_data(NAMESPACES)
+
+    assert rows
+    assert list(handels_register.XMLParser(str(path)).iter_xml_data(NAMESPACES)) == rows